@@ -1,69 +1,64 @@
 #!/usr/bin/env python3
-from collections import defaultdict
-import enum
-from functools import partial
-import itertools
+import argparse
+from collections import OrderedDict, defaultdict, deque
+import time
 
 import pyglet
-from pyglet.sprite import Sprite
 from pyglet.window import key
 
+from . import audio
 from . import maps
+from . import pack
+from . import replay
+from . import sim
+from . import telemetry
+from .sim import (
+    Dir, chunkof, chunksize, gridheight, gridsize, gridwidth, gridxoffset, gridyoffset, width,
+    height)
 
 fps = 30
 
-class Dir:
-    sw, w, nw, s, none, n, se, e, ne = itertools.product(range(-1, 2), repeat=2)
-
 class Color:
     black = (0, 0, 0, 255)
     white = (255, 255, 255, 255)
 
-movement = {
-    'h': Dir.w,
-    'j': Dir.s,
-    'k': Dir.n,
-    'l': Dir.e,
-    'a': Dir.w,
-    's': Dir.s,
-    'w': Dir.n,
-    'd': Dir.e,
-    key.MOTION_LEFT: Dir.w,
-    key.MOTION_DOWN: Dir.s,
-    key.MOTION_UP: Dir.n,
-    key.MOTION_RIGHT: Dir.e,
+motions = {
+    key.MOTION_LEFT: 'h',
+    key.MOTION_DOWN: 'j',
+    key.MOTION_UP: 'k',
+    key.MOTION_RIGHT: 'l',
 }
-_push = [5, 5, 5, 5, 5, 4, 4, 4, 3, 3, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1]
-#_push = [5, 5, 5, 4, 4, 4, 3, 3, 3, 2, 2, 2, 1, 1, 1]
-_bounce = [4, -2, -1, -1]
-gridsize = sum(_push)
-width, height = 1280, 720
 center = {'x': width // 2, 'y': height // 2}
 instructioncenter = {'x': width // 2, 'y': 40}
-gridwidth = width // gridsize
-gridheight = height // gridsize
-gridxoffset = (width - gridwidth * gridsize) // 2 + gridsize // 2
-gridyoffset = (height - gridheight * gridsize) // 2 + gridsize // 2
+# The small sprites all share one texture so each batch binds it once per
+# frame; the full-screen images are only drawn one at a time anyway.
+atlas = pyglet.image.atlas.TextureBin(texture_width=512, texture_height=512)
+def loadimage(name, *, packed=True):
+    image = pyglet.image.load('art/%s.png' % name)
+    if packed:
+        return atlas.add(image)
+    return image.get_texture()
+
 images = {}
-images['bg'] = pyglet.image.load('art/bg.png').get_texture()
-images['fish-left'] = pyglet.image.load('art/fish-left.png').get_texture()
+images['bg'] = loadimage('bg', packed=False)
+images['fish-left'] = loadimage('fish-left')
 images['fish-right'] = images['fish-left'].get_transform(flip_x=True)
-images['fish-front'] = pyglet.image.load('art/fish-front.png').get_texture()
-images['field-yellow'] = pyglet.image.load('art/field-yellow.png').get_texture()
-images['field-red'] = pyglet.image.load('art/field-red.png').get_texture()
-images['field-purple'] = pyglet.image.load('art/field-purple.png').get_texture()
-images['bubble1'] = pyglet.image.load('art/bubble1.png').get_texture()
-images['bubble2'] = pyglet.image.load('art/bubble2.png').get_texture()
-images['bubble3'] = pyglet.image.load('art/bubble3.png').get_texture()
-images['bubble4'] = pyglet.image.load('art/bubble4.png').get_texture()
-images['bubble5'] = pyglet.image.load('art/bubble3.png').get_texture()
-images['bubble6'] = pyglet.image.load('art/bubble2.png').get_texture()
-images['wall'] = pyglet.image.load('art/wall.png').get_texture()
-images['bwall'] = pyglet.image.load('art/bubblewall.png').get_texture()
-images['star1'] = pyglet.image.load('art/star1.png').get_texture()
-images['star2'] = pyglet.image.load('art/star2.png').get_texture()
-images['complete'] = pyglet.image.load('art/complete.png').get_texture()
-images['title'] = pyglet.image.load('art/title.png').get_texture()
+images['fish-front'] = loadimage('fish-front')
+images['field-yellow'] = loadimage('field-yellow')
+images['field-red'] = loadimage('field-red')
+images['field-purple'] = loadimage('field-purple')
+images['bubble1'] = loadimage('bubble1')
+images['bubble2'] = loadimage('bubble2')
+images['bubble3'] = loadimage('bubble3')
+images['bubble4'] = loadimage('bubble4')
+images['bubble5'] = images['bubble3']
+images['bubble6'] = images['bubble2']
+images['wall'] = loadimage('wall')
+images['bwall'] = loadimage('bubblewall')
+images['star1'] = loadimage('star1')
+images['star2'] = loadimage('star2')
+images['complete'] = loadimage('complete', packed=False)
+images['title'] = loadimage('title', packed=False)
 for image in images.values():
     image.anchor_x = image.width // 2
     image.anchor_y = image.height // 2
@@ -74,416 +69,550 @@ for name in 'blip shortblip bubble star reset pop complete'.split():
     sound = pyglet.media.StaticSource(pyglet.media.load('sound/%s.wav' % name))
     sounds[name] = sound
 
-_players = []
+voices = audio.VoicePool(audio.PygletBackend(sounds))
 def playsounds(*names):
-    player = pyglet.media.Player()
-    _players.append(player)
-    for name in names:
-        player.queue(sounds[name])
-    player.play()
+    voices.play(*names)
 
+# Things on screen rather than in the world, like the instructions.
 _batches = defaultdict(pyglet.graphics.Batch)
 
-label = partial(
-    pyglet.text.Label,
-    anchor_x='center',
-    anchor_y='baseline',
-    bold=True,
-    font_size=8,
-)
-biglabel = partial(
-    pyglet.text.Label,
-    anchor_x='center',
-    anchor_y='baseline',
-    bold=True,
-    font_size=18,
-)
+# Sprites in the world are batched by layer and by chunk, a square of
+# chunksize cells, so a frame only draws the chunks the camera can see and a
+# map a hundred times the size of the screen costs about the same to draw.
+_chunks = defaultdict(pyglet.graphics.Batch)
+
+def chunkbatch(layer, x, y):
+    """The batch for sprites of layer centred on pixel (x, y) of the world."""
+    return _chunks[(layer,) + chunkof(x, y)]
+
+class Screen:
+    """The part of the window that has changed since the last frame.
+
+    Sprites report the area they cover before and after each change, so a
+    frame only has to redraw the damaged rectangle, and a frame where nothing
+    changed can show the last one again.
+    """
+    whole = (0, 0, width, height)
+
+    def __init__(self):
+        self.camera = (0, 0)
+        self.damage = self.whole
+        self.window = None
+
+    def add(self, left, bottom, right, top):
+        left, bottom = max(0, int(left) - 1), max(0, int(bottom) - 1)
+        right, top = min(width, int(right) + 2), min(height, int(top) + 2)
+        if left >= right or bottom >= top:
+            return
+        if self.damage is not None:
+            l, b, r, t = self.damage
+            left, bottom, right, top = min(l, left), min(b, bottom), max(r, right), max(t, top)
+        self.damage = left, bottom, right, top
+        if self.window is not None:
+            self.window.invalid = True
+
+    def add_all(self):
+        self.add(*self.whole)
+
+    def take(self):
+        """The damaged rectangle, or None, and forget it."""
+        damage, self.damage = self.damage, None
+        return damage
+
+screen = Screen()
+
+
+class EventLoop(pyglet.app.EventLoop):
+    """Draws a window only when it is invalid.
+
+    pyglet's own loop redraws every window whenever a scheduled function has
+    run, so a level ticking thirty times a second would be drawn thirty times
+    a second even when nothing on it moves.
+    """
+    def idle(self):
+        dt = self.clock.update_time()
+        self.clock.call_scheduled_functions(dt)
+        for window in pyglet.app.windows:
+            if window.invalid:
+                window.switch_to()
+                window.dispatch_event('on_draw')
+                window.flip()
+        return self.clock.get_sleep_time(True)
+
+
+def _damaging(name):
+    prop = getattr(pyglet.sprite.Sprite, name)
+
+    def set(self, value):
+        if prop.fget(self) == value:
+            return
+        self.damage()
+        prop.fset(self, value)
+        self.damage()
+    return property(prop.fget, set)
+
+
+class Sprite(pyglet.sprite.Sprite):
+    """A sprite that damages the screen wherever it changes.
+
+    Sprites in the world are drawn through the camera; fixed ones, like the
+    instructions, are placed in window coordinates.
+    """
+    def __init__(self, *args, fixed=False, **kwargs):
+        self.fixed = fixed
+        super().__init__(*args, **kwargs)
+        self.damage()
+
+    x = _damaging('x')
+    y = _damaging('y')
+    image = _damaging('image')
+    visible = _damaging('visible')
+    opacity = _damaging('opacity')
+    scale = _damaging('scale')
+
+    def damage(self):
+        if not self.visible or screen.damage == screen.whole:
+            return
+        image = self.image
+        left = self.x - image.anchor_x * self.scale
+        bottom = self.y - image.anchor_y * self.scale
+        if not self.fixed:
+            left -= screen.camera[0]
+            bottom -= screen.camera[1]
+        screen.add(left, bottom, left + self.width, bottom + self.height)
+
+    def delete(self):
+        self.damage()
+        super().delete()
 
 
-class CollisionRect:
-    def __init__(self, obj):
-        self.x = obj.x - obj.width // 2
-        self.y = obj.y - obj.height // 2
-        self.width = obj.width - 24
-        self.height = obj.height - 24
-
-
-_collisions = set()
-def collides(a, b):
-    arect = CollisionRect(a)
-    brect = CollisionRect(b)
-    does_collide = all([
-        arect.x < brect.width + brect.x,
-        arect.x + arect.width > brect.x,
-        arect.y < brect.height + brect.y,
-        arect.y + arect.height > brect.y,
-    ])
-    if does_collide:
-        if (a, b) in _collisions:
-            return False
-        else:
-            _collisions.add((a, b))
-            return True
-    else:
-        if (a, b) in _collisions:
-            _collisions.remove((a, b))
-        return False
+def copyscreen(texture, left, bottom, right, top):
+    """Copy a rectangle of what has been drawn into the same place in texture."""
+    pyglet.gl.glBindTexture(texture.target, texture.id)
+    pyglet.gl.glCopyTexSubImage2D(
+        texture.target, 0, left, bottom, left, bottom, right - left, top - bottom)
+
+
+def drawstats(batches=None):
+    """Texture binds, draw calls and vertices per frame for each layer.
+
+    Counts the given (layer, batch) pairs, or every batch there is.
+    """
+    if batches is None:
+        batches = list(_batches.items()) + [(key[0], batch) for key, batch in _chunks.items()]
+    stats = {}
+    for name, batch in batches:
+        textures = set()
+        calls = 0
+        vertices = 0
+        for group, domains in batch.group_map.items():
+            texture = getattr(group, 'texture', None)
+            if texture is not None:
+                textures.add(texture.id)
+            calls += len(domains)
+            vertices += sum(sum(domain.allocator.sizes) for domain in domains.values())
+        binds, totalcalls, totalvertices = stats.get(name, (0, 0, 0))
+        stats[name] = binds + len(textures), totalcalls + calls, totalvertices + vertices
+    return stats
+
+# Captions are drawn white with a one-pixel black outline. Each distinct
+# caption is rasterized once into its own texture and then drawn as a single
+# sprite; the most recently used ones are kept for the next reset.
+captionsize = 8
+instructionsize = 18
+maxcaptions = 64
+_captions = OrderedDict()
+
+def caption(text, *, size, bold=True, fg=Color.white, bg=Color.black):
+    """A texture of text, anchored at the centre of its baseline."""
+    key = text, size, bold, fg, bg
+    if key in _captions:
+        _captions.move_to_end(key)
+        return _captions[key]
+    texture = _captions[key] = rasterize(*key)
+    if len(_captions) > maxcaptions:
+        _captions.popitem(last=False)
+    return texture
+
+def rasterize(text, size, bold, fg, bg):
+    font = pyglet.font.load(None, size, bold=bold)
+    glyphs = font.get_glyphs(text)
+    width = int(sum(glyph.advance for glyph in glyphs)) + 2
+    height = font.ascent - font.descent + 2
+    baseline = 1 - font.descent
+    alpha = bytearray(width * height)
+    pen = 1
+    for glyph in glyphs:
+        if glyph.width and glyph.height:
+            left, bottom = int(glyph.vertices[0]), int(glyph.vertices[1])
+            data = glyph.get_image_data().get_data('A', glyph.width)
+            # Some font backends store glyphs upside down in their texture.
+            flipped = glyph.tex_coords[1] > glyph.tex_coords[7]
+            for row in range(glyph.height):
+                y = baseline + bottom + (glyph.height - 1 - row if flipped else row)
+                if not 0 <= y < height:
+                    continue
+                for col in range(glyph.width):
+                    x = int(pen) + left + col
+                    if 0 <= x < width:
+                        i = y * width + x
+                        alpha[i] = max(alpha[i], data[row * glyph.width + col])
+        pen += glyph.advance
+    outline = bytearray(alpha)
+    for dx, dy in Dir.w, Dir.s, Dir.n, Dir.e, Dir.nw, Dir.ne, Dir.se, Dir.sw:
+        for y in range(max(0, dy), min(height, height + dy)):
+            for x in range(max(0, dx), min(width, width + dx)):
+                i = y * width + x
+                outline[i] = max(outline[i], alpha[i - dy * width - dx])
+    pixels = bytearray(4 * width * height)
+    for i, (a, o) in enumerate(zip(alpha, outline)):
+        pixels[4 * i:4 * i + 4] = (
+            bg[0] + (fg[0] - bg[0]) * a // 255,
+            bg[1] + (fg[1] - bg[1]) * a // 255,
+            bg[2] + (fg[2] - bg[2]) * a // 255,
+            o,
+        )
+    texture = pyglet.image.ImageData(width, height, 'RGBA', bytes(pixels)).get_texture()
+    texture.anchor_x = width // 2
+    texture.anchor_y = baseline
+    return texture
 
 
 class Label:
-    def __init__(self, *, text, offset=Dir.none, type=label):
-        super().__init__()
-        self.labels = [
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.black),
-            type(text, batch=_batches['label'], color=Color.white),
-        ]
-        self.shadowdirs = [
-            Dir.w,
-            Dir.s,
-            Dir.n,
-            Dir.e,
-            Dir.nw,
-            Dir.ne,
-            Dir.se,
-            Dir.sw,
-            Dir.none,
-        ]
+    """A caption; it follows its chunk around the world unless it is given
+    a batch of its own."""
+    def __init__(self, *, text, offset=Dir.none, size=captionsize, batch=None):
+        self.chunked = batch is None
+        if self.chunked:
+            batch = chunkbatch('label', 0, 0)
+        self.sprite = Sprite(caption(text, size=size), batch=batch, fixed=not self.chunked)
         self.offset = offset
 
+    @property
+    def visible(self):
+        return self.sprite.visible
+
+    @visible.setter
+    def visible(self, visible):
+        self.sprite.visible = visible
+
     def delete(self):
-        for label in self.labels:
-            label.delete()
+        self.sprite.delete()
 
     def place(self, x, y):
         ox, oy = self.offset
-        for label, (dx, dy) in zip(self.labels, self.shadowdirs):
-            label.x = x + dx + ox
-            label.y = y + dy + oy
+        self.sprite.x = x + ox
+        self.sprite.y = y + oy
+        if self.chunked:
+            batch = chunkbatch('label', x, y)
+            if self.sprite.batch is not batch:
+                self.sprite.batch = batch
 
     def update(self, dt):
         pass
 
 
-class Animated:
-    def __init__(self, *, imageprefix, delay, **kwargs):
-        batch = _batches[type(self).__name__.lower()]
-        self.frames = [
-            Sprite(image, batch=batch)
-            for name, image in sorted(images.items())
-            if name.startswith(imageprefix)
-        ]
-        super().__init__(
-            **kwargs,
-            width=self.frames[0].width,
-            height=self.frames[0].height,
-        )
-        self.parts.extend(self.frames)
-        self.delay = delay
-        self.frame = 0
-        self.paused = False
-        self.act(self.animate_iter(), id='animation')
-
-    def animate_iter(self):
-        while True:
-            if not self.paused:
-                self.frame = (self.frame + 1) % len(self.frames)
-                for sprite in self.frames:
-                    sprite.visible = False
-                self.frames[self.frame].visible = True
-            for _ in range(self.delay):
-                yield
-
-    def pause_animation(self):
-        self.paused = True
-
-
-class Collidable:
-    def collide(self, other):
-        raise NotImplementedError
-
-    def delete(self):
-        self.world.collidables.remove(self)
-        super().delete()
+class Visible:
+    """Gives a simulated entity its name label, keeps its sprites in the
+    batch of its layer and chunk, and hides them while it waits in the
+    world's pool; mixed in before the sim class, which declares the sprite
+    and label slots."""
+    __slots__ = ()
+    layer = None
 
-    def enter_world(self, world):
-        super().enter_world(world)
-        self.world.collidables.add(self)
-
-
-class GridCollidable:
-    def grid_collide(self, other):
-        raise NotImplementedError
-
-
-class Obj:
-    def __init__(self, *, name=None, width, height):
-        super().__init__()
-        self._x, self._y = 0, 0
-        self.width, self.height = width, height
-        self.actions = {}
-        self._ids = itertools.count()
-        self.parts = []
-        self.deleted = False
-        self.disable_collision = False
-        if name:
-            self.label = Label(text=name, offset=(0, height // 2 + 4))
-            self.parts.append(self.label)
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.name:
+            self.label = Label(text=self.name, offset=(0, self.height // 2 + 4))
         else:
             self.label = None
 
-    @property
-    def x(self):
-        return self._x
-
-    @property
-    def y(self):
-        return self._y
-
-    def act(self, iterator, *, id=None):
-        if id is None:
-            id = next(self._ids)
-        self.actions[id] = iterator
-
-    def check_collisions(self):
-        if not self.disable_collision:
-            for obj in self.world.collidables.copy():
-                if obj == self:
-                    continue
-                if collides(self, obj):
-                    obj.collide(self)
-        for obj in self.world.neighbors(self):
-            if isinstance(obj, GridCollidable):
-                obj.grid_collide(self)
+    def setup(self, **kwargs):
+        super().setup(**kwargs)
+        # Undo the fade-out of a pooled object that was deleted.
+        for part in self.parts:
+            part.opacity = 255
+            part.scale = 1
+            part.visible = True
+        if getattr(self, 'label', None) is not None:
+            self.label.visible = True
 
     def delete(self):
         if self.label is not None:
-            self.label.delete()
-        self.parts = [part for part in self.parts if not isinstance(part, Label)]
-        self.act(self.delete_iter(), id='delete')
-
-    def delete_iter(self):
-        for _ in range(3):
-            for part in self.parts:
-                part.scale += 1
-                part.opacity -= 64
-            yield
-        self.world.remove(self)
-        for part in self.parts:
-            part.delete()
-        self.deleted = True
-
-    def enter_world(self, world):
-        self.world = world
-
-    def is_done(self):
-        return True
+            self.label.visible = False
+        super().delete()
 
     def place(self, x, y):
+        super().place(x, y)
+        batch = chunkbatch(self.layer, x, y)
         for part in self.parts:
-            if isinstance(part, (Obj, Label)):
-                part.place(x, y)
-            else:
-                part.x = x
-                part.y = y
-        self._x = x
-        self._y = y
+            if part.batch is not batch:
+                part.batch = batch
+        if self.label is not None:
+            self.label.place(x, y)
 
-    def update(self, dt):
-        for id, action in list(self.actions.items()):
-            try:
-                next(action)
-            except StopIteration:
-                del self.actions[id]
-        if not self.deleted:
-            self.check_collisions()
-
-
-class Fish(Obj):
-    def __init__(self, *, batch=None, **kwargs):
-        batch = batch or _batches[type(self).__name__.lower()]
-        self.sprites = {
-            'left': Sprite(images['fish-left'], batch=batch),
-            'front': Sprite(images['fish-front'], batch=batch),
-            'right': Sprite(images['fish-right'], batch=batch),
-        }
-        super().__init__(**kwargs, height=images['fish-left'].height, width=images['fish-left'].width)
-        for sprite in self.sprites.values():
-            self.parts.append(sprite)
-            sprite.anchor_x = sprite.width // 2
-            sprite.anchor_y = sprite.height // 2
-            sprite.visible = False
-        self.sprites['left'].visible = True
-        self.direction = 'left'
-        self.disable_collision = False
-        self.frozen = False
-
-    def face(self, direction):
-        dx, _ = direction
-        if dx == 0:
-            return
-        elif dx < 0:
-            newdir = 'left'
-        elif dx > 0:
-            newdir = 'right'
-        if newdir != self.direction:
-            self.act(self.face_iter(newdir), id='face')
-            self.direction = newdir
-
-    def face_iter(self, dir):
-        self.sprites['left'].visible = False
-        self.sprites['right'].visible = False
-        self.sprites['front'].visible = True
-        yield
-        yield
-        self.sprites['front'].visible = False
-        self.sprites[dir].visible = True
-
-    def move(self, dir):
-        if self.world.try_move(self, dir):
-            self.act(self.move_iter(dir, _push))
-            return True
-        else:
-            self.act(self.move_iter(dir, _bounce))
-            return False
+    def retire(self):
+        super().retire()
+        for part in self.parts:
+            part.visible = False
+        if self.label is not None:
+            self.label.visible = False
 
-    def move_iter(self, dir, amounts):
-        for amount in amounts:
-            dx, dy = dir
-            new_x = self.x + dx*amount
-            new_y = self.y + dy*amount
-            self.place(new_x, new_y)
-            yield
 
+def animation(prefix):
+    """The images named prefix1, prefix2 and so on, in order."""
+    return [image for name, image in sorted(images.items()) if name.startswith(prefix)]
 
-class Field(Collidable, Obj):
-    def __init__(self, *, batch=None, state=0, **kwargs):
-        super().__init__(**kwargs, height=images['field-red'].height, width=images['field-red'].width)
-        batch = batch or _batches[type(self).__name__.lower()]
-        self.sprites = [
-            Sprite(images['field-yellow'], batch=batch),
-            Sprite(images['field-red'], batch=batch),
-            Sprite(images['field-purple'], batch=batch),
-        ]
-        self.parts.extend(self.sprites)
-        self.advance(state)
-
-    def advance(self, state=None):
-        if state is None:
-            state = (self.state + 1) % len(self.sprites)
-            playsounds('blip')
-        for sprite in self.sprites:
-            sprite.visible = False
-        self.sprites[state].visible = True
-        self.state = state
 
-    def collide(self, other):
-        if isinstance(other, Fish):
-            self.advance()
+class Animated:
+    """Shows the frames the class lists, one sprite per object."""
+    __slots__ = ()
+    frames = []
 
-    def is_done(self):
-        return self.state == 2
+    def __init__(self, **kwargs):
+        self.sprite = Sprite(self.frames[0], batch=chunkbatch(self.layer, 0, 0))
+        super().__init__(**kwargs)
+        self.parts = (self.sprite,)
 
+    def show_frame(self, frame):
+        # All the art is in one atlas, so this only rewrites texture coordinates.
+        if self.sprite.image is not self.frames[frame]:
+            self.sprite.image = self.frames[frame]
 
-class Wall(Obj):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs, width=images['wall'].width, height=images['wall'].height)
-        self.sprite = Sprite(images['wall'], batch=_batches['wall'])
-        self.parts.append(self.sprite)
 
+class Fish(Visible, sim.Fish):
+    __slots__ = ('sprite', 'label')
+    layer = 'fish'
 
-class BubbleWall(Obj):
     def __init__(self, **kwargs):
-        super().__init__(**kwargs, width=images['bwall'].width, height=images['bwall'].height)
-        self.sprite = Sprite(images['bwall'], batch=_batches['wall'])
-        self.parts.append(self.sprite)
+        self.sprite = Sprite(images['fish-left'], batch=chunkbatch(self.layer, 0, 0))
+        super().__init__(**kwargs)
+        self.parts = (self.sprite,)
+
+    def show_facing(self, direction):
+        image = images['fish-' + direction]
+        if self.sprite.image is not image:
+            self.sprite.image = image
 
 
-class Bubble(Animated, Collidable, GridCollidable, Obj):
+class Field(Visible, sim.Field):
+    __slots__ = ('sprite', 'label')
+    layer = 'field'
+    states = ['field-yellow', 'field-red', 'field-purple']
+
     def __init__(self, **kwargs):
-        super().__init__(
-            **kwargs,
-            imageprefix='bubble',
-            delay=3,
-        )
-        self.captured = None
-
-    def collide(self, other):
-        if other == self.captured:
-            other.disable_collision = True
-            self.act(self.rise_iter(), id='rise')
-
-    def grid_collide(self, other):
-        if isinstance(other, Fish) and not other.frozen:
-            other.frozen = True
-            self.captured = other
-
-    def rise_iter(self):
-        while True:
-            if self.world.try_move(self.captured, Dir.n):
-                playsounds('bubble')
-                yield from zip(
-                    Fish.move_iter(self, Dir.n, _push),
-                    self.captured.move_iter(Dir.n, _push),
-                )
+        self.sprite = Sprite(images[self.states[0]], batch=chunkbatch(self.layer, 0, 0))
+        super().__init__(**kwargs)
+        self.parts = (self.sprite,)
+
+    def show_state(self, state):
+        image = images[self.states[state]]
+        if self.sprite.image is not image:
+            self.sprite.image = image
+
+
+class FieldSprites:
+    """Sprites for the cells of a field grid, read from its array a chunk at a
+    time when the camera first shows that chunk, and kept for the next level."""
+    def __init__(self):
+        self.sprites = {}
+        self.spare = []
+        self.built = set()
+
+    def build(self, grid, chunk):
+        if chunk in self.built:
+            return
+        self.built.add(chunk)
+        span = chunksize * gridsize
+        cx, cy = chunk
+        # The cells whose centres lie in the chunk, rounding up.
+        gx0 = max(0, -((gridxoffset - cx * span) // gridsize))
+        gx1 = -((gridxoffset - (cx + 1) * span) // gridsize)
+        gy0 = max(0, -((gridyoffset - cy * span) // gridsize))
+        gy1 = -((gridyoffset - (cy + 1) * span) // gridsize)
+        for (gx, gy), state in grid.cells(gx0, gy0, gx1, gy1):
+            image = images[Field.states[state]]
+            x = gx * gridsize + gridxoffset
+            y = gy * gridsize + gridyoffset
+            batch = chunkbatch(Field.layer, x, y)
+            if self.spare:
+                sprite = self.spare.pop()
+                sprite.image = image
+                sprite.x, sprite.y = x, y
+                sprite.batch = batch
+                sprite.visible = True
             else:
-                break
-        self.captured.frozen = False
-        self.captured.disable_collision = False
-        self.delete()
-        playsounds('pop')
+                sprite = Sprite(image, x=x, y=y, batch=batch)
+            self.sprites[gx, gy] = sprite
 
+    def clear(self):
+        for sprite in self.sprites.values():
+            sprite.visible = False
+            self.spare.append(sprite)
+        self.sprites = {}
+        self.built = set()
+
+    def show(self, loc, state):
+        sprite = self.sprites.get(loc)
+        if sprite is not None:
+            sprite.image = images[Field.states[state]]
+
+
+class WallLayer:
+    """The walls of a level as plain sprites in one batch per chunk.
+
+    It is built from the level's sim.Baked and only drawn into the world's
+    static cache, so the walls cost nothing from frame to frame. Building
+    goes a sprite at a time through `building`, so it can be spread over
+    frames; build() finishes it.
+    """
+    images = {sim.walltile: 'wall', sim.bwalltile: 'bwall'}
+
+    def __init__(self, baked):
+        self.batches = defaultdict(pyglet.graphics.Batch)
+        self.sprites = []
+        self.building = self.build_iter(baked)
+
+    def build(self):
+        for _ in self.building:
+            pass
+
+    def build_iter(self, baked):
+        for (gx, gy), tile in baked.walls:
+            x = gx * gridsize + gridxoffset
+            y = gy * gridsize + gridyoffset
+            self.sprites.append(pyglet.sprite.Sprite(
+                images[self.images[tile]], x=x, y=y, batch=self.batches[chunkof(x, y)]))
+            yield
 
-class Star(Animated, Collidable, Obj):
-    def __init__(self, **kwargs):
-        super().__init__(
-            **kwargs,
-            imageprefix='star',
-            delay=10,
-        )
-        self.captured = None
-
-    def collide(self, other):
-        if isinstance(other, Fish) and not other.frozen:
-            playsounds('star')
-            self.delete()
-
-
-class World:
-    def __init__(self, *, maps):
-        self.grid = defaultdict(set)
-        self.width = gridwidth
-        self.height = gridheight
-        self.maps = maps
-        self.mapindex = -1
-        self.bg = Sprite(images['bg'], **center)
-        self.title = Sprite(images['title'], **center)
-        self.complete = Sprite(images['complete'], **center)
+    def delete(self):
+        for sprite in self.sprites:
+            sprite.delete()
+
+
+class Bubble(Visible, Animated, sim.Bubble):
+    __slots__ = ('sprite', 'label')
+    layer = 'bubble'
+    frames = animation('bubble')
+
+
+class Star(Visible, Animated, sim.Star):
+    __slots__ = ('sprite', 'label')
+    layer = 'star'
+    frames = animation('star')
+
+
+class Camera:
+    """The part of the world on screen, from pixel (x, y) up and to the right.
+
+    It keeps the fish in the middle of the window as far as it can without
+    showing anything past the edges of the world; a world no bigger than the
+    screen doesn't scroll at all.
+    """
+    def __init__(self):
+        self.x = 0
+        self.y = 0
+
+    def follow(self, world):
+        """Move to the fish; return whether the camera moved."""
+        player = world.player
+        if player is None or player.deleted:
+            return False
+        x = max(0, min(player.x - width // 2, (world.width - gridwidth) * gridsize))
+        y = max(0, min(player.y - height // 2, (world.height - gridheight) * gridsize))
+        if (x, y) == (self.x, self.y):
+            return False
+        self.x, self.y = screen.camera = x, y
+        screen.add_all()
+        return True
+
+    def visible(self):
+        """The chunks on screen.
+
+        Sprites hang over the edge of their chunk by up to half a tile, so
+        chunks just off screen count as on it.
+        """
+        span = chunksize * gridsize
+        x0, x1 = (self.x - gridsize) // span, (self.x + width + gridsize) // span
+        y0, y1 = (self.y - gridsize) // span, (self.y + height + gridsize) // span
+        return [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+
+    def chunks(self, layer):
+        """The batches of layer in the chunks on screen."""
+        for cx, cy in self.visible():
+            batch = _chunks.get((layer, cx, cy))
+            if batch is not None:
+                yield (layer, cx, cy), batch
+
+    def __enter__(self):
+        pyglet.gl.glPushMatrix()
+        pyglet.gl.glTranslatef(-self.x, -self.y, 0)
+
+    def __exit__(self, *exc_info):
+        pyglet.gl.glPopMatrix()
+
+
+class World(sim.World):
+    Fish = Fish
+    Field = Field
+    Bubble = Bubble
+    Star = Star
+
+    # Layers of the world in the order they are drawn, over the background
+    # and the walls; those never change during a level, so they are drawn
+    # once into a texture.
+    batchorder = ['field', 'star', 'fish', 'bubble', 'label']
+    # Wall layers of the last few levels played, by the key of their Baked.
+    maxwalllayers = 16
+    # Seconds of each frame that can go on getting the next level ready.
+    warmbudget = 0.005
+
+    def __init__(self, *, maps, stats=False, recording=None, profile=False, fieldgrid=False,
+                 prefetch=False):
+        super().__init__(maps=maps, fieldgrid=fieldgrid, prefetch=prefetch)
+        self.fieldsprites = FieldSprites()
+        self.stats = stats
+        self.overlay = None
+        if profile:
+            self.timings = telemetry.Timings()
+            self.overlay = pyglet.text.Label(
+                '', x=8, y=height - 8, anchor_y='top', multiline=True, width=width,
+                font_name='monospace', font_size=9, color=Color.white)
+            pyglet.clock.schedule_interval(self.update_overlay, 0.5)
+        self.recording = recording
+        self.playback = None
+        if recording is not None:
+            self.playback = deque(recording.inputs)
+            pyglet.clock.schedule_interval(self.feed, 1 / fps)
+        self.bg = Sprite(images['bg'], fixed=True, **center)
+        self.title = Sprite(images['title'], fixed=True, **center)
+        self.complete = Sprite(images['complete'], fixed=True, **center)
         self.complete.visible = False
         self.instruction = None
+        self.camera = Camera()
         self.window = pyglet.window.Window(width, height)
+        screen.window = self.window
+        # The background and static layers as the camera sees them, redrawn
+        # when staticdirty is set, and the last frame shown. Both are plain
+        # sprites, since drawing them damages nothing.
+        self.static = pyglet.sprite.Sprite(pyglet.image.Texture.create(width, height))
+        self.staticdirty = True
+        self.frame = pyglet.sprite.Sprite(pyglet.image.Texture.create(width, height))
+        self.walllayers = OrderedDict()
+        self.walllayer = None
+        # The upcoming level being readied between frames, and how far that
+        # has got, as (upcoming, generator).
+        self.warming = None
 
         self.set_instruction('Press <Space> or <Enter> to start')
-        self.mode = 'stop'
 
         @self.window.event
         def on_draw():
-            self.window.clear()
-            self.bg.draw()
-            _batches['field'].draw()
-            _batches['wall'].draw()
-            _batches['star'].draw()
-            _batches['fish'].draw()
-            _batches['bubble'].draw()
-            _batches['label'].draw()
-            self.complete.draw()
-            self.title.draw()
+            self.draw()
+
+        @self.window.event
+        def on_expose():
+            self.window.invalid = True
 
         @self.window.event
         def on_key_press(symbol, modifiers):
@@ -494,34 +623,13 @@ class World:
         def on_text(text):
             if text in ['q']:
                 pyglet.clock.schedule(self.exit)
-            elif (
-                (self.mode == 'stop' and text in [' ', '\r']) or
-                (self.mode == 'go' and text in ['[', ']'])
-            ):
-                if text == '[':
-                    if self.mapindex > 0:
-                        self.mapindex -= 1
-                elif text == ']':
-                    if self.mapindex < len(self.maps) - 1:
-                        self.mapindex += 1
-                else:
-                    self.mapindex += 1
-                if self.mapindex < len(self.maps):
-                    self.reset()
-                else:
-                    self.mode = 'finished'
-                    self.set_instruction('No further puzzles exist :(  Press Q to exit.')
-            elif self.mode == 'go' and text in movement:
-                if not self.player.frozen and not self.moved_this_update:
-                    self.player.move(movement[text])
-                    self.moved_this_update = True
-                self.player.face(movement[text])
-            elif self.mode == 'go' and text in ['r']:
-                self.mode = 'reset'
+            elif self.playback is None:
+                self.press(text)
 
         @self.window.event
         def on_text_motion(motion):
-            on_text(motion)
+            if motion in motions:
+                on_text(motions[motion])
 
         self.musicplayer = pyglet.media.Player()
         music = pyglet.media.SourceGroup(sounds['music-intro'].audio_format, None)
@@ -535,112 +643,229 @@ class World:
         def on_eos():
             music.loop = True
 
+    def draw(self):
+        """Show the last frame again, after redrawing whatever has changed."""
+        timings = self.timings
+        timings.frame += 1
+        with timings.phase('draw'):
+            if self.camera.follow(self):
+                self.staticdirty = True
+                self.show(self.camera.visible())
+            if self.fieldgrid is not None:
+                for chunk in self.camera.visible():
+                    self.fieldsprites.build(self.fieldgrid, chunk)
+            if self.staticdirty:
+                with timings.phase('draw.static'):
+                    self.draw_static()
+            damage = screen.take()
+            self.frame.draw()
+            if damage is not None:
+                self.draw_damage(damage)
+        self.window.invalid = False
+        if self.overlay is not None:
+            self.overlay.draw()
+
+    def draw_static(self):
+        self.staticdirty = False
+        self.window.clear()
+        self.bg.draw()
+        if self.walllayer is not None:
+            with self.camera:
+                for chunk in self.camera.visible():
+                    batch = self.walllayer.batches.get(chunk)
+                    if batch is not None:
+                        batch.draw()
+        copyscreen(self.static.image, 0, 0, width, height)
+        screen.add_all()
+
+    def draw_damage(self, damage):
+        """Redraw the damaged rectangle over the last frame, and keep the result."""
+        timings = self.timings
+        left, bottom, right, top = damage
+        pyglet.gl.glScissor(left, bottom, right - left, top - bottom)
+        pyglet.gl.glEnable(pyglet.gl.GL_SCISSOR_TEST)
+        self.static.draw()
+        with self.camera:
+            for name in self.batchorder:
+                with timings.phase('draw.' + name):
+                    for _, batch in self.camera.chunks(name):
+                        batch.draw()
+        _batches['hud'].draw()
+        self.complete.draw()
+        self.title.draw()
+        pyglet.gl.glDisable(pyglet.gl.GL_SCISSOR_TEST)
+        copyscreen(self.frame.image, left, bottom, right, top)
+
     def reset(self):
-        for obj in self.objs():
-            obj.delete()
-        for player in _players:
-            player.delete()
-        _players.clear()
-        _batches.clear()
-        self.mode = 'go'
-        self.set_instruction('Use ←↓↑→ or WASD to move. Press R to reset.')
+        with self.timings.phase('reset'):
+            # Everything is redrawn after a reset, so sprites needn't say
+            # where they changed while the level is rebuilt.
+            screen.add_all()
+            voices.stop()
+            self.set_instruction('Use ←↓↑→ or WASD to move. Press R to reset.')
+            pyglet.clock.unschedule(self.update_all)
+            pyglet.clock.schedule_interval(self.update_all, 1 / fps)
+            self.complete.visible = False
+            self.title.visible = False
+            self.fieldsprites.clear()
+            super().reset()
+            self.camera.follow(self)
+            self.show(self.camera.visible())
+            self.walllayer = self.walllayerfor(self.baked)
+            self.walllayer.build()
+            self.staticdirty = True
+            if self.upcoming is not None:
+                pyglet.clock.unschedule(self.warm)
+                pyglet.clock.schedule_interval(self.warm, 1 / fps)
+        if self.stats:
+            self.camera.follow(self)
+            chunks = self.camera.visible()
+            print('{}x{} cells, {} chunks on screen'.format(self.width, self.height, len(chunks)))
+            batches = [('hud', _batches['hud'])]
+            batches += [
+                ('wall', self.walllayer.batches[chunk])
+                for chunk in chunks if chunk in self.walllayer.batches]
+            batches += [
+                (name, _chunks[key]) for name in self.batchorder
+                for key, _ in self.camera.chunks(name)]
+            stats = drawstats(batches)
+            for name, counts in stats.items():
+                print('{:>8}: {} texture binds, {} draw calls, {} vertices'.format(
+                    name, *counts))
+            print('   total: {} texture binds, {} draw calls, {} vertices'.format(
+                *map(sum, zip(*stats.values()))))
+
+    def walllayerfor(self, baked):
+        """The wall layer of baked, kept or started anew, as the newest kept."""
+        layer = self.walllayers.pop(baked.key, None)
+        if layer is None:
+            layer = WallLayer(baked)
+        self.walllayers[baked.key] = layer
+        if len(self.walllayers) > self.maxwalllayers:
+            self.walllayers.popitem(last=False)[1].delete()
+        return layer
+
+    def stage_iter(self, baked):
+        layer = self.walllayerfor(baked)
+        # Not yield from: dropping this generator mustn't close the layer's.
+        for _ in layer.building:
+            yield
+        yield from super().stage_iter(baked)
+
+    def warm(self, dt):
+        """Spend up to warmbudget getting the upcoming level ready, once the
+        prefetch thread has baked it; reset() schedules this each frame until
+        the level is ready."""
+        upcoming = self.upcoming
+        if upcoming is None:
+            pyglet.clock.unschedule(self.warm)
+            return
+        if not upcoming[1].done():
+            return
+        if self.warming is None or self.warming[0] is not upcoming:
+            self.warming = upcoming, self.stage_iter(upcoming[1].result())
+        deadline = time.perf_counter() + self.warmbudget
+        with self.timings.phase('warm'):
+            for _ in self.warming[1]:
+                if time.perf_counter() >= deadline:
+                    break
+            else:
+                pyglet.clock.unschedule(self.warm)
+
+    def complete_level(self):
+        super().complete_level()
         pyglet.clock.unschedule(self.update_all)
-        pyglet.clock.schedule_interval(self.update_all, 1 / fps)
-        self.complete.visible = False
-        self.title.visible = False
-        self.grid = defaultdict(set)
-        self.collidables = set()
-        self.moved_this_update = False
-        self.player = Fish(name='T. Jefferson')
-        for (gx, gy), char in maps.parse(self.maps[self.mapindex]):
-            if char == 'y':
-                self.spawn(Field, gx, gy, state=0)
-            elif char == 'r':
-                self.spawn(Field, gx, gy, state=1)
-            elif char == 'p':
-                self.spawn(Field, gx, gy, state=2)
-            elif char == 's':
-                self.put(self.player, gx, gy)
-            elif char == 'o':
-                self.spawn(Bubble, gx, gy)
-            elif char == '#':
-                self.spawn(Wall, gx, gy)
-            elif char == '%':
-                self.spawn(BubbleWall, gx, gy)
-            elif char == '*':
-                self.spawn(Star, gx, gy)
-        playsounds('reset')
-
-    def is_complete(self):
-        return all(obj.is_done() for objs in self.grid.values() for obj in objs)
-
-    def locate(self, obj):
-        for loc, objs in self.grid.items():
-            if obj in objs:
-                return loc
-        raise ValueError('{obj!r} is not in the grid')
-
-    def neighbors(self, obj):
-        return self.grid[self.locate(obj)] - {obj}
-
-    def objs(self):
-        return list(itertools.chain.from_iterable(map(list, self.grid.values())))
-
-    def put(self, obj, gx, gy):
-        self.grid[gx, gy].add(obj)
-        obj.enter_world(self)
-        x = gx * gridsize + gridxoffset
-        y = gy * gridsize + gridyoffset
-        obj.place(x, y)
-
-    def remove(self, obj):
-        gx, gy = self.locate(obj)
-        self.grid[gx, gy].remove(obj)
+        self.complete.visible = True
+        self.set_instruction('Press <Space> or <Enter> to continue')
+
+    def feed(self, dt=None):
+        """Press the recorded keys that are due; the window's are ignored."""
+        while self.playback and self.playback[0][0] <= self.steps:
+            self.press(self.playback.popleft()[1])
+        if not self.playback and self.steps == self.recording.steps:
+            pyglet.clock.unschedule(self.feed)
+            ok = replay.digest(self) == self.recording.digest
+            print('replay finished after {} steps: {}'.format(
+                self.steps, 'ok' if ok else 'digest MISMATCH'))
+
+    def finish(self):
+        super().finish()
+        self.set_instruction('No further puzzles exist :(  Press Q to exit.')
+
+    def playsounds(self, *names):
+        playsounds(*names)
+
+    def show_field(self, loc, state):
+        self.fieldsprites.show(loc, state)
 
     def set_instruction(self, text):
         if self.instruction is not None:
             self.instruction.delete()
-        self.instruction = Label(text=text, type=biglabel)
+        self.instruction = Label(text=text, size=instructionsize, batch=_batches['hud'])
         self.instruction.place(**instructioncenter)
 
-    def spawn(self, type, gx, gy, **kwargs):
-        self.put(type(**kwargs), gx, gy)
-
-    def try_move(self, obj, dir):
-        dx, dy = dir
-        gx, gy = self.locate(obj)
-        nx = gx + dx
-        ny = gy + dy
-        if 0 <= nx < self.width and 0 <= ny < self.height:
-            if any(isinstance(o, (BubbleWall, Wall)) for o in self.grid[nx, ny]):
-                if not (
-                    any(isinstance(o, BubbleWall) for o in self.grid[nx, ny]) and
-                    obj.frozen
-                ):
-                    return False
-            self.grid[gx, gy].remove(obj)
-            self.grid[nx, ny].add(obj)
-            return True
-        else:
-            return False
-
     def update_all(self, dt):
-        if self.mode == 'reset':
-            self.reset()
-        for obj in self.objs():
-            obj.update(dt)
-        if self.is_complete():
-            self.mode = 'stop'
-            pyglet.clock.unschedule(world.update_all)
-            self.complete.visible = True
-            self.set_instruction('Press <Space> or <Enter> to continue')
-            playsounds('complete')
-        self.moved_this_update = False
+        with self.timings.phase('update'):
+            if self.playback is not None:
+                self.feed()
+            self.step()
+
+    def update_overlay(self, dt):
+        self.overlay.text = '\n'.join(
+            '{:<18} p50 {p50:7.2f}  p95 {p95:7.2f}  p99 {p99:7.2f} ms'.format(name, **row)
+            for name, row in self.timings.summary().items()
+        )
+        self.window.invalid = True
 
     def exit(self, dt):
         self.window.close()
         pyglet.app.exit()
 
 
-world = World(maps=maps.maps)
+parser = argparse.ArgumentParser(prog='python -m game')
+parser.add_argument(
+    '--stats', action='store_true',
+    help='print texture binds, draw calls and vertices per frame after each reset',
+)
+parser.add_argument('--record', metavar='FILE', help='save every key pressed to FILE on exit')
+parser.add_argument('--replay', metavar='FILE', help='play back a recording instead of the keyboard')
+parser.add_argument('--pack', metavar='FILE', help='play the levels in a compiled level pack')
+parser.add_argument('--level', type=int, default=0, help='start at this level')
+parser.add_argument(
+    '--fieldgrid', action='store_true',
+    help='keep fields in a NumPy array rather than as objects, for very large maps',
+)
+parser.add_argument(
+    '--no-prefetch', action='store_true',
+    help="build each level as it starts, not while the one before is played",
+)
+parser.add_argument(
+    '--profile', metavar='FILE',
+    help='show frame-phase timings on screen and save them to FILE (.json or .csv) on exit',
+)
+args = parser.parse_args()
+recording = None
+if args.replay:
+    # A recording brings its own levels and starting level.
+    recording = replay.load(args.replay)
+    levels, level, packpath = replay.levels(recording), recording.level, recording.pack
+else:
+    levels = pack.Pack(args.pack) if args.pack else maps.maps
+    level, packpath = args.level, args.pack
+world = World(
+    maps=levels,
+    stats=args.stats,
+    recording=recording,
+    profile=bool(args.profile),
+    fieldgrid=args.fieldgrid,
+    prefetch=not args.no_prefetch,
+)
+world.mapindex = level - 1
+if args.record:
+    world.inputs = []
+pyglet.app.event_loop = EventLoop()
 pyglet.app.run()
+if args.record:
+    replay.save(args.record, replay.record(world, level=level, pack=packpath))
+if args.profile:
+    world.timings.dump(args.profile)
@@ -0,0 +1,182 @@
+"""A fixed set of voices for sound effects.
+
+Instead of a new player per effect, VoicePool keeps a few voices and reuses
+them. Each effect has a priority and an optional cap on how many voices it may
+hold at once; when the cap is hit (say, a run of field blips) the oldest voice
+playing that effect is restarted, and when every voice is busy the oldest one
+playing something no more important than the new effect is stolen.
+
+The pool talks to a backend: PygletBackend plays through pyglet.media, and
+NullBackend plays nothing but keeps voices busy for as long as the effect
+would last, so the pool behaves the same without an audio device.
+
+    python -m game.audio
+
+checks capping, stealing and dropping on NullBackend with a fake clock.
+"""
+import itertools
+import sys
+import time
+
+priorities = {
+    'complete': 3,
+    'reset': 2,
+    'bubble': 1,
+    'pop': 1,
+    'star': 1,
+}
+limits = {
+    'blip': 2,
+    'shortblip': 2,
+}
+
+
+class VoicePool:
+    def __init__(self, backend, *, voices=8, priorities=priorities, limits=limits):
+        self.backend = backend
+        self.voices = [backend.voice() for _ in range(voices)]
+        self.priorities = priorities
+        self.limits = limits
+        self._order = itertools.count()
+        # voice -> (effect name, priority, start order) for voices in use
+        self.playing = {}
+
+    def play(self, *names):
+        """Play names back to back on one voice; return it, or None if dropped."""
+        name = names[0]
+        priority = self.priorities.get(name, 0)
+        self._reap()
+        same = [voice for voice, (n, _, _) in self.playing.items() if n == name]
+        if len(same) >= self.limits.get(name, len(self.voices)):
+            voice = self._oldest(same)
+        else:
+            voice = self._free()
+        if voice is None:
+            victims = [
+                voice for voice, (_, p, _) in self.playing.items() if p <= priority
+            ]
+            if not victims:
+                return None
+            voice = self._oldest(victims)
+        voice.play([self.backend.source(n) for n in names])
+        self.playing[voice] = name, priority, next(self._order)
+        return voice
+
+    def stop(self):
+        for voice in self.playing:
+            voice.stop()
+        self.playing.clear()
+
+    def _free(self):
+        for voice in self.voices:
+            if voice not in self.playing:
+                return voice
+        return None
+
+    def _oldest(self, voices):
+        return min(voices, key=lambda voice: self.playing[voice][2])
+
+    def _reap(self):
+        for voice in [voice for voice in self.playing if not voice.busy()]:
+            del self.playing[voice]
+
+
+class NullBackend:
+    """Plays nothing, but voices stay busy for the length of their effects."""
+    def __init__(self, *, durations=None, default=0.25, clock=time.monotonic):
+        self.durations = durations or {}
+        self.default = default
+        self.clock = clock
+
+    def source(self, name):
+        return self.durations.get(name, self.default)
+
+    def voice(self):
+        return NullVoice(self.clock)
+
+
+class NullVoice:
+    def __init__(self, clock):
+        self.clock = clock
+        self.end = None
+
+    def busy(self):
+        return self.end is not None and self.clock() < self.end
+
+    def play(self, sources):
+        self.end = self.clock() + sum(sources)
+
+    def stop(self):
+        self.end = None
+
+
+class PygletBackend:
+    def __init__(self, sounds):
+        import pyglet
+        self.pyglet = pyglet
+        self.sounds = sounds
+
+    def source(self, name):
+        return self.sounds[name]
+
+    def voice(self):
+        return PygletVoice(self.pyglet.media.Player())
+
+
+class PygletVoice:
+    def __init__(self, player):
+        self.player = player
+
+    def busy(self):
+        return self.player.playing and self.player.source is not None
+
+    def play(self, sources):
+        self.stop()
+        for source in sources:
+            self.player.queue(source)
+        self.player.play()
+
+    def stop(self):
+        self.player.pause()
+        while self.player.source is not None:
+            self.player.next_source()
+
+
+def check():
+    """Run VoicePool on NullBackend with a fake clock; return [(case, ok)]."""
+    now = [0.0]
+    backend = NullBackend(durations={'complete': 2.0}, default=1.0, clock=lambda: now[0])
+    results = []
+
+    # A capped effect restarts its oldest voice rather than take another.
+    pool = VoicePool(backend, voices=4)
+    first, second, third = pool.play('blip'), pool.play('blip'), pool.play('blip')
+    results.append(('cap', third is first and second is not first and len(pool.playing) == 2))
+
+    # With every voice busy, the oldest no more important effect is stolen.
+    pool = VoicePool(backend, voices=2)
+    blip, bubble = pool.play('blip'), pool.play('bubble')
+    results.append(('steal lowest oldest', pool.play('complete') is blip))
+    results.append(('steal by priority', pool.play('reset') is bubble))
+
+    # Nothing no more important is playing: the new effect is dropped.
+    results.append(('drop', pool.play('blip') is None))
+
+    # Once an effect has played out its voice is free again.
+    now[0] += 1.5
+    results.append(('reap', pool.play('blip') is bubble and len(pool.playing) == 2))
+    now[0] += 1.0
+    results.append(('reap all', pool.play('pop') is not None and len(pool.playing) == 1))
+    return results
+
+
+def main():
+    results = check()
+    for case, ok in results:
+        print('{}: {}'.format(case, 'ok' if ok else 'FAILED'))
+    if not all(ok for _, ok in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""Headless benchmarks for the simulation.
+
+    python -m game.bench levels [--steps N]
+    python -m game.bench grid [--size N] [--ops N]
+    python -m game.bench collisions [--count N] [--steps N]
+    python -m game.bench idle [--counts N ...] [--steps N]
+    python -m game.bench resets [--repeat N] [--size N]
+    python -m game.bench suite [--sizes N ...] [-o RESULTS] [--compare BASELINE]
+    python -m game.bench fields [--sizes N ...]
+    python -m game.bench env [--count N] [--steps N] [--processes N]
+    python -m game.bench memory [--sizes N ...]
+
+The suite times the core operations on synthetic worlds of each size and can
+save the results as JSON; given a baseline saved the same way it exits with
+status 1 if anything got slower by more than --tolerance.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from . import maps
+from . import sim
+from .sim import Dir, World, movement
+
+
+def synthetic(width, height, *, seed=0, density=0.5):
+    """A random map of the given size, with the fish in the middle.
+
+    Roughly density of the cells are occupied: mostly fields, with walls,
+    bubble walls, bubbles and stars mixed in.
+    """
+    rng = random.Random(seed)
+    tiles = 'yyyyrrrpp##%o*'
+    rows = []
+    for _ in range(height):
+        rows.append([
+            rng.choice(tiles) if rng.random() < density else ' '
+            for _ in range(width)
+        ])
+    rows[height // 2][width // 2] = 's'
+    return '\n'.join(''.join(row) for row in rows)
+
+
+def synthetic_world(width, height, *, fieldgrid=False, **kwargs):
+    world = World(
+        maps=[synthetic(width, height, **kwargs)], width=width, height=height,
+        fieldgrid=fieldgrid)
+    world.mapindex = 0
+    world.reset()
+    return world
+
+
+def timeit(func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - start) / n
+
+
+def measure(func, *, budget=0.05, rounds=3):
+    """Seconds per call of func: the best of a few rounds of about budget each."""
+    n = max(1, int(budget / max(timeit(func, 1), 1e-7)))
+    return min(timeit(func, n) for _ in range(rounds))
+
+
+def play(world, steps, *, seed=0, every=4):
+    """Step world, pressing a random movement key every few ticks."""
+    rng = random.Random(seed)
+    keys = sorted(movement)
+    for tick in range(steps):
+        if tick % every == 0:
+            world.press(rng.choice(keys))
+        world.step()
+
+
+def bench_levels(args):
+    print('{:>5} {:>8} {:>12}'.format('level', 'objs', 'steps/sec'))
+    for index, map in enumerate(maps.maps):
+        world = World(maps=[map])
+        world.mapindex = 0
+        world.reset()
+        nobjs = len(world.objs())
+        start = time.perf_counter()
+        play(world, args.steps, seed=args.seed)
+        elapsed = time.perf_counter() - start
+        print('{:>5} {:>8} {:>12.0f}'.format(index, nobjs, args.steps / elapsed))
+
+
+def bench_grid(args):
+    world = synthetic_world(args.size, args.size, seed=args.seed)
+    player = world.player
+    rng = random.Random(args.seed)
+    dirs = [Dir.n, Dir.s, Dir.e, Dir.w]
+    print('{} cells, {} objects'.format(args.size * args.size, len(world.objs())))
+    for name, func in [
+        ('locate', lambda: world.locate(player)),
+        ('neighbors', lambda: world.neighbors(player)),
+        ('try_move', lambda: world.try_move(player, rng.choice(dirs))),
+    ]:
+        print('{:>10} {:>10.2f} us'.format(name, timeit(func, args.ops) * 1e6))
+
+
+def bench_collisions(args):
+    """count each of fish, bubbles and stars, wandering a field-strewn map."""
+    size = args.size
+    world = synthetic_world(size, size, seed=args.seed, density=0.2)
+    rng = random.Random(args.seed)
+    dirs = [Dir.n, Dir.s, Dir.e, Dir.w]
+    free = [
+        (gx, gy) for gx in range(size) for gy in range(size)
+        if (gx, gy) not in world.grid and not world.static((gx, gy))
+    ]
+    rng.shuffle(free)
+    fish = [world.player]
+    for _ in range(args.count):
+        fish.append(world.Fish())
+        world.put(fish[-1], *free.pop())
+        world.spawn(world.Bubble, *free.pop())
+        world.spawn(world.Star, *free.pop())
+    print('{} objects, {} collidables'.format(len(world.objs()), len(world.collidables)))
+    start = time.perf_counter()
+    for tick in range(args.steps):
+        for f in rng.sample(fish, len(fish) // 10):
+            if not f.frozen:
+                f.move(rng.choice(dirs))
+        world.step()
+    elapsed = time.perf_counter() - start
+    print('{:.2f} ms/step'.format(elapsed / args.steps * 1e3))
+
+
+def screenful(world):
+    """The chunks a window centred on the fish shows, as the game's camera would."""
+    span = sim.chunksize * sim.gridsize
+    player = world.player
+    x0 = (player.x - sim.width // 2 - sim.gridsize) // span
+    x1 = (player.x + sim.width // 2 + sim.gridsize) // span
+    y0 = (player.y - sim.height // 2 - sim.gridsize) // span
+    y1 = (player.y + sim.height // 2 + sim.gridsize) // span
+    return [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+
+
+def bench_idle(args):
+    """Per-tick cost of a world nobody is playing, against its size.
+
+    The world shows a window's worth of chunks around the fish, as in the
+    game, so only the objects there animate. actions is the time spent
+    resuming due tasks; step is a whole tick.
+    """
+    print('{:>8} {:>8} {:>12} {:>12}'.format('objs', 'tasks', 'actions us', 'step us'))
+    for count in args.counts:
+        size = max(4, int((count / 0.5) ** 0.5))
+        world = synthetic_world(size, size, seed=args.seed)
+        world.show(screenful(world))
+        nobjs = len(world.objs())
+        world.step()
+        ntasks = sum(len(obj.actions) for obj in world.objs())
+        step = timeit(world.step, args.steps)
+        actions = timeit(world.scheduler.run, args.steps)
+        print('{:>8} {:>8} {:>12.1f} {:>12.1f}'.format(
+            nobjs, ntasks, actions * 1e6, step * 1e6))
+
+
+def bench_resets(args):
+    """Median time to reset each level once the world has been played."""
+    levels = [('maps[{}]'.format(index), map) for index, map in enumerate(maps.maps)]
+    if args.size:
+        levels.append(('synthetic', synthetic(args.size, args.size, seed=args.seed)))
+    print('{:>10} {:>8} {:>10}'.format('level', 'objs', 'reset ms'))
+    for name, map in levels:
+        width = max(len(line) for line in map.splitlines())
+        height = len(map.splitlines())
+        world = World(
+            maps=[map], width=max(width, sim.gridwidth), height=max(height, sim.gridheight))
+        world.goto(0)
+        times = []
+        for _ in range(args.repeat):
+            play(world, 5, seed=args.seed)
+            times.append(timeit(world.reset, 1))
+        times.sort()
+        print('{:>10} {:>8} {:>10.3f}'.format(
+            name, len(world.objs()), times[len(times) // 2] * 1e3))
+
+
+def bench_fields(args):
+    """Field objects against a field grid (needs NumPy)."""
+    print('{:>6} {:>8} {:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'size', 'fields', 'mode', 'reset ms', 'step us', 'complete us', 'counts us'))
+    for size in args.sizes:
+        for fieldgrid in False, True:
+            world = synthetic_world(size, size, seed=args.seed, fieldgrid=fieldgrid)
+            if fieldgrid:
+                nfields = len(world.fieldgrid)
+                counts = world.fieldgrid.counts
+            else:
+                fields = [obj for objs in world.layered['field'].values() for obj in objs]
+                nfields = len(fields)
+
+                def counts():
+                    found = [0] * sim.Field.nstates
+                    for field in fields:
+                        found[field.state] += 1
+                    return found
+            play(world, 20, seed=args.seed)
+            reset = measure(world.reset, rounds=1)
+            step = measure(lambda: play(world, 1, seed=args.seed), rounds=1)
+            print('{:>6} {:>8} {:>8} {:>12.2f} {:>12.1f} {:>12.2f} {:>12.1f}'.format(
+                size, nfields, 'grid' if fieldgrid else 'objects', reset * 1e3, step * 1e6,
+                measure(world.is_complete) * 1e6, measure(counts) * 1e6))
+
+
+def bench_env(args):
+    """Moves per second through env.BatchEnv (needs NumPy)."""
+    from .env import BatchEnv, keys
+    rng = random.Random(args.seed)
+    print('{:>9} {:>6} {:>12} {:>14}'.format('processes', 'envs', 'moves/sec', 'moves/hour'))
+    for processes in args.processes:
+        with BatchEnv(maps.maps, args.count, processes=processes) as envs:
+            envs.reset()
+            start = time.perf_counter()
+            for _ in range(args.steps):
+                envs.step([rng.randrange(len(keys)) for _ in range(args.count)])
+            rate = args.count * args.steps / (time.perf_counter() - start)
+        print('{:>9} {:>6} {:>12.0f} {:>14.0f}'.format(processes, args.count, rate, rate * 3600))
+
+
+def allocated(func):
+    """What func returns, and the bytes it allocated that are still held."""
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def bench_memory(args):
+    """Memory held per 10,000 entities: of each type alone, then as whole
+    synthetic worlds with their grids, layers and tasks."""
+    print('{:>10} {:>8} {:>14}'.format('entities', 'count', 'KiB per 10k'))
+    for kind in sim.Fish, sim.Field, sim.Bubble, sim.Star:
+        objs, size = allocated(lambda: [kind() for _ in range(10000)])
+        print('{:>10} {:>8} {:>14.0f}'.format(kind.__name__, len(objs), size / 1024))
+    for size in args.sizes:
+        world, held = allocated(lambda: synthetic_world(size, size, seed=args.seed))
+        count = len(world.cells)
+        print('{:>10} {:>8} {:>14.0f}'.format(
+            'world {}'.format(size), count, held / count * 10000 / 1024))
+
+
+def suite(size, *, seed=0):
+    """{operation: seconds per call} on a size x size synthetic world."""
+    mapstring = synthetic(size, size, seed=seed)
+    world = synthetic_world(size, size, seed=seed)
+    rng = random.Random(seed)
+    dirs = [Dir.n, Dir.s, Dir.e, Dir.w]
+    objs = world.objs()
+    keys = sorted(movement)
+
+    def check_all():
+        for obj in objs:
+            obj.check_collisions()
+
+    def tick():
+        world.press(rng.choice(keys))
+        world.step()
+
+    results = {
+        'parse': measure(lambda: list(maps.parse(mapstring))),
+        'reset': measure(world.reset, rounds=1),
+    }
+    # reset() retired every object and placed them again, maybe elsewhere;
+    # the rest runs on the world as it is now.
+    player = world.player
+    field = next(iter(world.layered['field'].values()))[0]
+    objs = world.objs()
+    results.update({
+        'try_move': measure(lambda: world.try_move(player, rng.choice(dirs))),
+        'collides': measure(lambda: world.collides(player, field)),
+        'check_collisions': measure(player.check_collisions),
+        'check_collisions_all': measure(check_all, rounds=1),
+        'is_complete': measure(world.is_complete),
+        'step': measure(tick, rounds=1),
+    })
+    counts = {}
+    for obj in objs:
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return {'objects': counts, 'seconds': results}
+
+
+def bench_suite(args):
+    report = {
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'sizes': {},
+    }
+    print('{:>6} {:>8} {:>22} {:>12}'.format('size', 'objs', 'operation', 'us/call'))
+    for size in args.sizes:
+        entry = report['sizes'][str(size)] = suite(size, seed=args.seed)
+        nobjs = sum(entry['objects'].values())
+        for name, seconds in entry['seconds'].items():
+            print('{:>6} {:>8} {:>22} {:>12.2f}'.format(size, nobjs, name, seconds * 1e6))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(baseline, report, tolerance=args.tolerance):
+            sys.exit(1)
+
+
+def compare(baseline, report, *, tolerance):
+    """Print how report compares with baseline; False if anything regressed."""
+    ok = True
+    for size, entry in sorted(report['sizes'].items(), key=lambda item: int(item[0])):
+        before = baseline['sizes'].get(size)
+        if before is None:
+            continue
+        for name, seconds in entry['seconds'].items():
+            if name not in before['seconds']:
+                continue
+            ratio = seconds / before['seconds'][name]
+            regressed = ratio > 1 + tolerance
+            ok = ok and not regressed
+            print('{:>6} {:>22} {:>7.2f}x{}'.format(
+                size, name, ratio, '  REGRESSION' if regressed else ''))
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m game.bench')
+    parser.add_argument('--seed', type=int, default=0)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    levels = commands.add_parser('levels', help='steps/sec for every level in maps.maps')
+    levels.add_argument('--steps', type=int, default=3000)
+    levels.set_defaults(func=bench_levels)
+    grid = commands.add_parser('grid', help='grid lookups on a large synthetic map')
+    grid.add_argument('--size', type=int, default=200)
+    grid.add_argument('--ops', type=int, default=200)
+    grid.set_defaults(func=bench_grid)
+    collisions = commands.add_parser('collisions', help='many moving fish, bubbles and stars')
+    collisions.add_argument('--count', type=int, default=200)
+    collisions.add_argument('--size', type=int, default=60)
+    collisions.add_argument('--steps', type=int, default=20)
+    collisions.set_defaults(func=bench_collisions)
+    idle = commands.add_parser('idle', help='per-tick cost of an idle world by size')
+    idle.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    idle.add_argument('--steps', type=int, default=30)
+    idle.set_defaults(func=bench_idle)
+    resets = commands.add_parser('resets', help='World.reset latency per level')
+    resets.add_argument('--repeat', type=int, default=11)
+    resets.add_argument('--size', type=int, default=0, help='also a synthetic map this big')
+    resets.set_defaults(func=bench_resets)
+    suiteparser = commands.add_parser('suite', help='core operations on large synthetic maps')
+    suiteparser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200])
+    suiteparser.add_argument('-o', '--output', help='save the results as JSON')
+    suiteparser.add_argument('--compare', metavar='BASELINE', help='results to compare against')
+    suiteparser.add_argument('--tolerance', type=float, default=0.25,
+                             help='allowed slowdown before failing, as a fraction')
+    suiteparser.set_defaults(func=bench_suite)
+    fields = commands.add_parser('fields', help='Field objects against a NumPy field grid')
+    fields.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200])
+    fields.set_defaults(func=bench_fields)
+    env = commands.add_parser('env', help='moves/sec through the batched environment API')
+    env.add_argument('--count', type=int, default=32, help='environments')
+    env.add_argument('--steps', type=int, default=50, help='moves per environment')
+    env.add_argument('--processes', type=int, nargs='+', default=[0, 2, 4],
+                     help='worker processes to try; 0 steps them in this one')
+    env.set_defaults(func=bench_env)
+    memory = commands.add_parser('memory', help='memory held per 10,000 entities')
+    memory.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200])
+    memory.set_defaults(func=bench_memory)
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
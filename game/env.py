@@ -0,0 +1,238 @@
+"""The puzzle as environments for bots: reset(), step(action) and NumPy
+observations, one level at a time or many at once.
+
+    env = Env(maps.maps, 3)
+    obs, info = env.reset()
+    obs, reward, terminated, truncated, info = env.step(3)
+
+An action is an index into `keys`: west, south, north or east. Each step
+presses that key and runs the simulation until the fish has finished moving
+(or riding a bubble), the way solve.check() plays a solution, so one step is
+one move however many ticks it takes. The reward is 1 for the move that
+completes the level and 0 otherwise. An episode terminates when the level is
+complete or the fish is stuck for good, and is truncated after `maxmoves`
+moves.
+
+An observation is a uint8 array of shape (2, height, width), indexed
+[channel, row, col] with row 0 at the bottom like FieldGrid.states. Channel 0
+says what is in each cell (opencell, wallcell, ...; the fish hides whatever
+it is on) and channel 1 holds the state of the field there, or `nofield`.
+Levels smaller than the observation are padded with open cells.
+
+BatchEnv steps N environments together and returns their observations
+stacked, resetting each one as its episode ends; with processes it spreads
+them over worker processes. NumPy is needed (pip install game[numpy]).
+"""
+import multiprocessing
+
+import numpy
+
+from . import fieldgrid
+from . import sim
+from .sim import World
+
+keys = 'hjkl'
+# What channel 0 of an observation holds for each cell.
+opencell, wallcell, bwallcell = sim.opentile, sim.walltile, sim.bwalltile
+fishcell, bubblecell, starcell, fieldcell = 3, 4, 5, 6
+# Channel 1 where there is no field.
+nofield = fieldgrid.empty
+
+
+class Env:
+    """Level `level` of maps, played a move per step.
+
+    The observation shape is the level's size unless `shape` (height, width)
+    says otherwise; reset() can switch to any level that fits it.
+    """
+    def __init__(self, maps, level=0, *, shape=None, maxmoves=200, timeout=1000,
+                 fieldgrid=False):
+        self.world = World(maps=maps, fieldgrid=fieldgrid)
+        self.level = level
+        self.maxmoves = maxmoves
+        self.timeout = timeout
+        if shape is None:
+            baked = self.world.bake(maps[level])
+            shape = baked.height, baked.width
+        self.shape = tuple(shape)
+        self.moves = 0
+
+    def reset(self, *, level=None):
+        """Start the level again, or start level; return (obs, info)."""
+        if level is not None:
+            self.level = level
+        world = self.world
+        world.goto(self.level)
+        if world.height > self.shape[0] or world.width > self.shape[1]:
+            raise ValueError('level {} is {}x{}, bigger than the observation {}x{}'.format(
+                self.level, world.width, world.height, self.shape[1], self.shape[0]))
+        self.moves = 0
+        self.settle()
+        return self.observe(), self.info()
+
+    def step(self, action):
+        """Make a move; return (obs, reward, terminated, truncated, info)."""
+        world = self.world
+        world.press(keys[action])
+        self.moves += 1
+        stuck = not self.settle()
+        complete = world.mode == 'stop'
+        info = self.info()
+        if stuck:
+            info['stuck'] = True
+        return (
+            self.observe(), 1.0 if complete else 0.0, complete or stuck,
+            self.moves >= self.maxmoves, info)
+
+    def settle(self):
+        """Step until the fish can move again; False if it never can."""
+        world = self.world
+        player = world.player
+        for _ in range(self.timeout):
+            world.step()
+            if world.mode != 'go' or not (player.frozen or player.actions):
+                # A fish dropped off by a bubble touches what it landed on
+                # during the following tick.
+                world.step()
+                return True
+        return False
+
+    def observe(self):
+        world = self.world
+        width, height = world.width, world.height
+        obs = numpy.zeros((2,) + self.shape, dtype=numpy.uint8)
+        cells, fields = obs[0, :height, :width], obs[1, :height, :width]
+        obs[1] = nofield
+        cells[:] = numpy.frombuffer(world.statics, dtype=numpy.uint8).reshape(height, width)
+        if world.fieldgrid is not None:
+            states = world.fieldgrid.states
+            fields[:] = states
+            cells[states != nofield] = fieldcell
+        codes = {world.Field: fieldcell, world.Bubble: bubblecell, world.Star: starcell}
+        for obj, (gx, gy) in world.cells.items():
+            code = codes.get(type(obj))
+            if code is not None:
+                cells[gy, gx] = code
+                if code == fieldcell:
+                    fields[gy, gx] = obj.state
+        gx, gy = world.locate(world.player)
+        cells[gy, gx] = fishcell
+        return obs
+
+    def info(self):
+        return {'level': self.level, 'moves': self.moves, 'ticks': self.world.ticks}
+
+
+class BatchEnv:
+    """n environments stepped together, with observations of shape
+    (n, 2, height, width).
+
+    Environment i plays levels[i % len(levels)], every level of maps by
+    default; the observations are as big as the biggest of those. When an
+    episode ends, that environment is reset at once: the observation
+    returned is its new first one, and its info holds the last one as
+    'final_observation'.
+
+    With processes, the environments are split between that many worker
+    processes (at most n), which step their share in parallel; maps must
+    then pickle, so pass a list of map strings rather than a Pack.
+    """
+    def __init__(self, maps, n, *, levels=None, processes=0, **kwargs):
+        if levels is None:
+            levels = range(len(maps))
+        levels = [levels[i % len(levels)] for i in range(n)]
+        if 'shape' not in kwargs:
+            world = World(maps=maps)
+            sizes = [world.bake(maps[level]) for level in set(levels)]
+            kwargs['shape'] = (
+                max(baked.height for baked in sizes), max(baked.width for baked in sizes))
+        self.n = n
+        self.shape = (n, 2) + tuple(kwargs['shape'])
+        self.envs = None
+        self.workers = []
+        processes = min(processes, n)
+        if processes:
+            self.slices = [
+                slice(n * i // processes, n * (i + 1) // processes) for i in range(processes)]
+            for part in self.slices:
+                conn, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_work, args=(child, maps, levels[part], kwargs), daemon=True)
+                process.start()
+                child.close()
+                self.workers.append((conn, process))
+        else:
+            self.envs = [Env(maps, level, **kwargs) for level in levels]
+
+    def reset(self):
+        """Reset every environment; return (obs, infos)."""
+        if self.envs is not None:
+            return _reset(self.envs)
+        for conn, _ in self.workers:
+            conn.send(('reset', None))
+        return _join([conn.recv() for conn, _ in self.workers])
+
+    def step(self, actions):
+        """Make a move in each environment; return (obs, rewards, terminated,
+        truncated, infos) with an entry per environment."""
+        if self.envs is not None:
+            return _step(self.envs, actions)
+        for (conn, _), part in zip(self.workers, self.slices):
+            conn.send(('step', list(actions[part])))
+        return _join([conn.recv() for conn, _ in self.workers])
+
+    def close(self):
+        for conn, process in self.workers:
+            conn.send(('close', None))
+            process.join()
+            conn.close()
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _reset(envs):
+    obs, infos = zip(*(env.reset() for env in envs))
+    return numpy.stack(obs), list(infos)
+
+
+def _step(envs, actions):
+    results = []
+    for env, action in zip(envs, actions):
+        obs, reward, terminated, truncated, info = env.step(action)
+        if terminated or truncated:
+            info['final_observation'] = obs
+            obs, _ = env.reset()
+        results.append((obs, reward, terminated, truncated, info))
+    obs, rewards, terminated, truncated, infos = zip(*results)
+    return (
+        numpy.stack(obs), numpy.array(rewards, dtype=numpy.float32),
+        numpy.array(terminated), numpy.array(truncated), list(infos))
+
+
+def _join(parts):
+    """Concatenate what each worker returned, entry by entry."""
+    joined = []
+    for values in zip(*parts):
+        if isinstance(values[0], list):
+            joined.append([value for part in values for value in part])
+        else:
+            joined.append(numpy.concatenate(values))
+    return tuple(joined)
+
+
+def _work(conn, maps, levels, kwargs):
+    envs = [Env(maps, level, **kwargs) for level in levels]
+    while True:
+        command, arg = conn.recv()
+        if command == 'reset':
+            conn.send(_reset(envs))
+        elif command == 'step':
+            conn.send(_step(envs, arg))
+        else:
+            break
+    conn.close()
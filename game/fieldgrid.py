@@ -0,0 +1,91 @@
+"""Every field of a level as one NumPy array instead of one Field each.
+
+World(fieldgrid=True) spawns no Field objects. Their states go into a
+FieldGrid instead: a uint8 array indexed [row, col] holding 0 (yellow),
+1 (red), 2 (purple) or `empty`. A fish advances the cells it starts to overlap
+exactly as it would advance Field objects. The grid counts as a single goal,
+done when no cell is yellow or red. Completion, counting fields by colour and
+resetting a level are then array operations however many fields there are.
+
+NumPy is an optional dependency (pip install game[numpy]); this module is
+only imported when a world asks for a field grid.
+"""
+import numpy
+
+from .sim import gridsize, gridxoffset, gridyoffset, tilesize
+
+empty = 255
+nstates = 3
+
+
+class FieldGrid:
+    def __init__(self):
+        self.states = numpy.full((0, 0), empty, dtype=numpy.uint8)
+        self.unfinished = 0
+        self.touching = {}
+
+    def __len__(self):
+        return int(numpy.count_nonzero(self.states != empty))
+
+    def reset(self, width, height, fields):
+        """Start a level of width x height holding ((col, row), state) fields."""
+        if self.states.shape == (height, width):
+            self.states.fill(empty)
+        else:
+            self.states = numpy.full((height, width), empty, dtype=numpy.uint8)
+        if fields:
+            locs = numpy.array([loc for loc, _ in fields], dtype=numpy.intp)
+            self.states[locs[:, 1], locs[:, 0]] = [state for _, state in fields]
+        self.unfinished = int(numpy.count_nonzero(self.states < 2))
+        self.touching = {}
+
+    def advance(self, loc):
+        """Move the field at loc on to its next state and return that."""
+        gx, gy = loc
+        state = int(self.states[gy, gx])
+        if state == 2:
+            self.unfinished += 1
+        new = self.states[gy, gx] = (state + 1) % nstates
+        if new == 2:
+            self.unfinished -= 1
+        return new
+
+    def counts(self):
+        """The number of yellow, red and purple fields."""
+        return tuple(int(n) for n in numpy.bincount(self.states.ravel(), minlength=256)[:nstates])
+
+    def cells(self, x0=0, y0=0, x1=None, y1=None):
+        """((col, row), state) for every field, or every one in a rectangle of
+        columns x0 to x1 and rows y0 to y1, exclusive; bottom row first."""
+        states = self.states[y0:y1, x0:x1]
+        rows, cols = numpy.nonzero(states != empty)
+        return [
+            ((x0 + int(col), y0 + int(row)), int(state))
+            for col, row, state in zip(cols, rows, states[rows, cols])
+        ]
+
+    def is_done(self):
+        return self.unfinished == 0
+
+    def left(self):
+        return self.unfinished
+
+    def touch(self, obj):
+        """The cells obj has just started to overlap, like World.collides()."""
+        height, width = self.states.shape
+        # Same rects as sim.overlaps(): 24px short of the tile each way.
+        left = obj._x - obj.width // 2
+        bottom = obj._y - obj.height // 2
+        gx0 = (left - gridxoffset + tilesize[0] // 2 - tilesize[0] + 24) // gridsize + 1
+        gx1 = (left + obj.width - 24 - gridxoffset + tilesize[0] // 2 - 1) // gridsize
+        gy0 = (bottom - gridyoffset + tilesize[1] // 2 - tilesize[1] + 24) // gridsize + 1
+        gy1 = (bottom + obj.height - 24 - gridyoffset + tilesize[1] // 2 - 1) // gridsize
+        now = {
+            (gx, gy)
+            for gy in range(max(gy0, 0), min(gy1, height - 1) + 1)
+            for gx in range(max(gx0, 0), min(gx1, width - 1) + 1)
+            if self.states[gy, gx] != empty
+        }
+        before = self.touching.get(obj, set())
+        self.touching[obj] = now
+        return sorted(now - before)
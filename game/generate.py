@@ -0,0 +1,143 @@
+"""Generate random levels and keep the ones the solver proves solvable.
+
+    python -m game.generate OUTDIR [--count N] [--moves MIN MAX] [--jobs N]
+
+Each candidate is a walled room of random size with some inner walls, fields,
+bubbles, bubble walls and stars, built from a seed. Candidates are solved in
+worker processes, and one is accepted if its shortest solution is between MIN
+and MAX moves; that length is its difficulty. Accepted levels are written as
+they arrive, one map per file named after its seed (OUTDIR/000042.txt), and a
+line per level giving its file, seed, moves and solution is appended to
+OUTDIR/levels.jsonl. Running again into the same OUTDIR skips the seeds and
+maps already listed there, so only new levels are added. The map files can be
+passed straight to game.validate or game.pack.
+"""
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import json
+import os
+import random
+import sys
+import time
+
+from .sim import gridheight, gridwidth
+from .solve import GaveUp, solve
+
+
+def candidate(seed, *, width=gridwidth, height=gridheight):
+    """A random map string, the same one for the same seed."""
+    rng = random.Random(seed)
+    w = rng.randint(3, min(12, width - 2))
+    h = rng.randint(2, min(6, height - 3))
+    left = rng.randint(0, width - w - 2)
+    top = rng.randint(1, height - h - 2)
+    rows = [[' '] * width for _ in range(height)]
+    for y in range(top, top + h + 2):
+        for x in range(left, left + w + 2):
+            rows[y][x] = '#'
+    inside = [(x, y) for y in range(top + 1, top + h + 1) for x in range(left + 1, left + w + 1)]
+    rng.shuffle(inside)
+    for x, y in inside:
+        rows[y][x] = ' '
+    free = list(inside)
+
+    def take(char):
+        x, y = free.pop()
+        rows[y][x] = char
+
+    take('s')
+    for _ in range(rng.randint(1, max(1, len(inside) // 4))):
+        if free:
+            take(rng.choice('yyyrrp'))
+    for char, chance in ('#', 0.1), ('%', 0.05), ('o', 0.04), ('*', 0.03):
+        for _ in range(len(inside)):
+            if free and rng.random() < chance:
+                take(char)
+    return '\n' + '\n'.join(''.join(row).rstrip() for row in rows) + '\n'
+
+
+def attempt(seed, *, moves, limit):
+    """Solve the candidate for seed; return its entry if it is acceptable."""
+    map = candidate(seed)
+    if not any(char in 'yr' for char in map):
+        return None
+    try:
+        solution = solve(map, limit=limit)
+    except GaveUp:
+        return None
+    if solution is None or not moves[0] <= len(solution.moves) <= moves[1]:
+        return None
+    return {
+        'seed': seed,
+        'moves': len(solution.moves),
+        'solution': solution.moves,
+        'explored': solution.explored,
+        'map': map,
+    }
+
+
+def existing(outdir):
+    """The seeds and maps of the levels already listed in outdir."""
+    seeds, maps = set(), set()
+    try:
+        index = open(os.path.join(outdir, 'levels.jsonl'))
+    except FileNotFoundError:
+        return seeds, maps
+    with index:
+        for line in index:
+            entry = json.loads(line)
+            seeds.add(entry['seed'])
+            try:
+                with open(os.path.join(outdir, entry['file'])) as f:
+                    maps.add(f.read())
+            except FileNotFoundError:
+                pass
+    return seeds, maps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m game.generate')
+    parser.add_argument('outdir')
+    parser.add_argument('--count', type=int, default=100, help='levels to accept')
+    parser.add_argument('--moves', type=int, nargs=2, default=(10, 40), metavar=('MIN', 'MAX'),
+                        help='accept levels whose shortest solution is this long')
+    parser.add_argument('--seed', type=int, default=0, help='first candidate seed')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--limit', type=int, default=100000, help='states to expand per candidate')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    known, maps = existing(args.outdir)
+    seeds = (seed for seed in range(args.seed, sys.maxsize) if seed not in known)
+    accepted = tried = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.jobs) as pool, \
+            open(os.path.join(args.outdir, 'levels.jsonl'), 'a') as index:
+        pending = {
+            pool.submit(attempt, next(seeds), moves=args.moves, limit=args.limit)
+            for _ in range(2 * args.jobs)
+        }
+        while pending and accepted < args.count:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tried += 1
+                entry = future.result()
+                # Two seeds can still make the same map.
+                if entry is not None and accepted < args.count and entry['map'] not in maps:
+                    maps.add(entry['map'])
+                    name = '{:06}.txt'.format(entry['seed'])
+                    with open(os.path.join(args.outdir, name), 'w') as f:
+                        f.write(entry.pop('map'))
+                    index.write(json.dumps(dict(entry, file=name), sort_keys=True) + '\n')
+                    index.flush()
+                    accepted += 1
+                pending.add(
+                    pool.submit(attempt, next(seeds), moves=args.moves, limit=args.limit))
+        for future in pending:
+            future.cancel()
+    elapsed = time.perf_counter() - start
+    print('{} accepted of {} tried in {:.1f}s'.format(accepted, tried, elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,7 @@
                  ######
 
 """
+import hashlib
 
 maps = [
 """
@@ -136,6 +137,28 @@ maps = [
 ]
 
 def parse(map):
+    """((col, row), char) for each cell of a map, with row 0 at the bottom.
+
+    map is either a string like the ones above or a Level from a compiled
+    pack, which only has its occupied cells.
+    """
+    if not isinstance(map, str):
+        return map.cells()
+    return _parsetext(map)
+
+
+def key(map):
+    """A SHA-1 of a map string or pack Level, to cache work done on it."""
+    h = hashlib.sha1()
+    if isinstance(map, str):
+        h.update(map.encode('utf-8'))
+    else:
+        h.update(repr((map.width, map.height)).encode())
+        h.update(map.cols.tobytes() + map.rows.tobytes() + bytes(map.chars))
+    return h.digest()
+
+
+def _parsetext(map):
     lines = map.splitlines()
     rows = len(lines)
     for row, line in zip(reversed(range(rows)), lines):
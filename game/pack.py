@@ -0,0 +1,144 @@
+"""Compile text maps into a binary level pack, and load levels from one.
+
+    python -m game.pack OUTPUT [FILE ...] [--no-builtin]
+
+A pack is a header, an index with one entry per level, and then each level's
+occupied cells as three arrays: column, row and the map character. Columns and
+rows are bytes when the level is smaller than 256 cells each way, otherwise
+little-endian uint16s. Empty cells aren't stored. Pack() maps the file
+and decodes a level only when it is asked for, so a pack of thousands of
+levels opens in constant time and World can jump straight to any of them.
+
+Header:  magic 'FISHPACK', uint16 version, uint32 level count
+Index:   per level uint32 offset, uint32 cells, uint16 width, uint16 height
+"""
+import argparse
+from array import array
+import mmap
+import struct
+import sys
+
+from . import maps
+
+magic = b'FISHPACK'
+version = 1
+header = struct.Struct('<8sHI')
+entry = struct.Struct('<IIHH')
+
+
+class Level:
+    """A decoded level; maps.parse() accepts one in place of a map string."""
+    def __init__(self, width, height, cols, rows, chars):
+        self.width = width
+        self.height = height
+        self.cols = cols
+        self.rows = rows
+        self.chars = chars
+
+    def __len__(self):
+        return len(self.chars)
+
+    def cells(self):
+        for col, row, char in zip(self.cols, self.rows, self.chars.decode('ascii')):
+            yield (col, row), char
+
+
+class Pack:
+    """The levels of a pack file, decoded one at a time on demand."""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        got, self.version, self.count = header.unpack_from(self.data)
+        if got != magic:
+            raise ValueError('{} is not a level pack'.format(path))
+        if self.version != version:
+            raise ValueError('{} is a version {} pack'.format(path, self.version))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('level {} is not in the pack'.format(index))
+        offset, count, width, height = entry.unpack_from(
+            self.data, header.size + index * entry.size)
+        typecode = _typecode(width, height)
+        size = array(typecode).itemsize * count
+        cols = _unpack(typecode, self.data[offset:offset + size])
+        rows = _unpack(typecode, self.data[offset + size:offset + 2 * size])
+        chars = self.data[offset + 2 * size:offset + 2 * size + count]
+        return Level(width, height, cols, rows, chars)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build(mapstrings):
+    """The bytes of a pack holding each of mapstrings, in order."""
+    levels = []
+    for mapstring in mapstrings:
+        cells = [(loc, char) for loc, char in maps.parse(mapstring) if char != ' ']
+        lines = mapstring.splitlines()
+        width = max(map(len, lines), default=0)
+        height = len(lines)
+        typecode = _typecode(width, height)
+        cols = array(typecode, (col for (col, _), _ in cells))
+        rows = array(typecode, (row for (_, row), _ in cells))
+        if sys.byteorder != 'little':
+            cols.byteswap()
+            rows.byteswap()
+        chars = ''.join(char for _, char in cells).encode('ascii')
+        body = cols.tobytes() + rows.tobytes() + chars
+        levels.append((len(cells), width, height, body))
+    out = bytearray(header.pack(magic, version, len(levels)))
+    offset = header.size + entry.size * len(levels)
+    for count, width, height, body in levels:
+        out += entry.pack(offset, count, width, height)
+        offset += len(body)
+    for _, _, _, body in levels:
+        out += body
+    return bytes(out)
+
+
+def _typecode(width, height):
+    return 'B' if max(width, height) < 256 else 'H'
+
+
+def _unpack(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m game.pack')
+    parser.add_argument('output')
+    parser.add_argument('files', nargs='*', help='map files to add after the built-in levels')
+    parser.add_argument('--no-builtin', action='store_true', help='leave out maps.maps')
+    args = parser.parse_args(argv)
+    mapstrings = [] if args.no_builtin else list(maps.maps)
+    for path in args.files:
+        with open(path) as f:
+            mapstrings.append(f.read())
+    data = build(mapstrings)
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    print('{} levels, {} bytes'.format(len(mapstrings), len(data)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""Record the keys sent to a World and play them back.
+
+    python -m game.replay FILE [--realtime] [--fps N] [--fieldgrid]
+
+A recording holds every key World.press() received, each tagged with the
+number of steps the world had taken when it arrived, followed by the total
+number of steps and a digest of the final state. It also says which levels
+were played: the level the title screen led to, the pack file they came from
+(None for the built-in maps) and a SHA-1 of those levels. Pressing the same
+keys at the same steps into a fresh World on the same levels reproduces the
+session exactly, so a recording can be kept as a regression fixture: replaying
+it fails if the digest changes.
+
+The file starts with a magic string, then a varint for the starting level, a
+length-prefixed UTF-8 pack path (empty for the built-in maps) and the 20-byte
+SHA-1 of the levels, then varints for the number of steps and of keys, then
+per key a varint step delta and a length-prefixed UTF-8 string, and ends with
+the 20-byte SHA-1 digest. Files from before the levels were recorded
+(FISHREC1) start at level 0 of the built-in maps.
+"""
+import argparse
+from collections import namedtuple
+import hashlib
+import sys
+import time
+
+from . import maps
+from . import pack
+from .sim import World, gridsize, gridxoffset, gridyoffset, walltile
+
+magic = b'FISHREC2'
+oldmagic = b'FISHREC1'
+
+Recording = namedtuple('Recording', 'inputs steps digest level pack source')
+
+
+def digest(world):
+    """A SHA-1 of everything the puzzle rules care about.
+
+    Walls, and fields in a field grid, count as if they were Wall, BubbleWall
+    and Field objects, so digests don't depend on how the world stores them.
+    """
+    state = [
+        (type(obj).__name__, obj.x, obj.y, getattr(obj, 'state', -1))
+        for obj in world.objs()
+    ]
+    state.extend(
+        ('Wall' if tile == walltile else 'BubbleWall',
+         gx * gridsize + gridxoffset, gy * gridsize + gridyoffset, -1)
+        for (gx, gy), tile in world.walls
+    )
+    if world.fieldgrid is not None:
+        state.extend(
+            ('Field', gx * gridsize + gridxoffset, gy * gridsize + gridyoffset, fieldstate)
+            for (gx, gy), fieldstate in world.fieldgrid.cells()
+        )
+    state.sort()
+    h = hashlib.sha1()
+    h.update(repr((world.mapindex, world.mode, world.ticks, world.steps)).encode())
+    h.update(repr(state).encode())
+    return h.digest()
+
+
+def source(levels):
+    """A SHA-1 of a list of maps or a Pack, to tell which levels were played."""
+    h = hashlib.sha1()
+    if isinstance(levels, pack.Pack):
+        h.update(levels.data)
+    else:
+        for map in levels:
+            h.update(maps.key(map))
+    return h.digest()
+
+
+def record(world, *, level=0, pack=None):
+    """The keys world was sent since it started at level, from pack if given."""
+    return Recording(
+        list(world.inputs), world.steps, digest(world), level, pack, source(world.maps))
+
+
+def levels(recording):
+    """The levels recording was made on: its pack, or the built-in maps."""
+    played = pack.Pack(recording.pack) if recording.pack is not None else maps.maps
+    if recording.source is not None and source(played) != recording.source:
+        raise ValueError('{} has changed since the recording was made'.format(
+            recording.pack or 'the built-in maps'))
+    return played
+
+
+def save(path, recording):
+    out = bytearray(magic)
+    _varint(out, recording.level)
+    data = (recording.pack or '').encode('utf-8')
+    _varint(out, len(data))
+    out += data
+    out += recording.source
+    _varint(out, recording.steps)
+    _varint(out, len(recording.inputs))
+    last = 0
+    for step, text in recording.inputs:
+        data = text.encode('utf-8')
+        _varint(out, step - last)
+        _varint(out, len(data))
+        out += data
+        last = step
+    out += recording.digest
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = len(magic)
+    if data.startswith(magic):
+        level, pos = _readvarint(data, pos)
+        length, pos = _readvarint(data, pos)
+        packpath = data[pos:pos + length].decode('utf-8') or None
+        pos += length
+        levelsource = data[pos:pos + 20]
+        pos += 20
+    elif data.startswith(oldmagic):
+        level, packpath, levelsource = 0, None, None
+    else:
+        raise ValueError('{} is not a recording'.format(path))
+    steps, pos = _readvarint(data, pos)
+    count, pos = _readvarint(data, pos)
+    inputs = []
+    step = 0
+    for _ in range(count):
+        delta, pos = _readvarint(data, pos)
+        length, pos = _readvarint(data, pos)
+        step += delta
+        inputs.append((step, data[pos:pos + length].decode('utf-8')))
+        pos += length
+    return Recording(inputs, steps, data[pos:pos + 20], level, packpath, levelsource)
+
+
+def play(recording, *, world=None, fps=None):
+    """Feed a recording into a fresh world and return it.
+
+    world must have been made on levels(recording). With fps, steps are
+    paced to that rate instead of running flat out.
+    """
+    if world is None:
+        world = World(maps=levels(recording))
+    world.mapindex = recording.level - 1
+    interval = 1 / fps if fps else 0
+    deadline = time.perf_counter()
+
+    def step():
+        nonlocal deadline
+        if interval:
+            deadline += interval
+            time.sleep(max(0, deadline - time.perf_counter()))
+        world.step()
+
+    for when, text in recording.inputs:
+        while world.steps < when:
+            step()
+        world.press(text)
+    while world.steps < recording.steps:
+        step()
+    return world
+
+
+def _varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _readvarint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m game.replay')
+    parser.add_argument('file')
+    parser.add_argument('--realtime', action='store_true', help='step at --fps instead of flat out')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--fieldgrid', action='store_true', help='keep fields in a NumPy array')
+    args = parser.parse_args(argv)
+
+    recording = load(args.file)
+    start = time.perf_counter()
+    world = play(
+        recording, world=World(maps=levels(recording), fieldgrid=args.fieldgrid),
+        fps=args.fps if args.realtime else None)
+    elapsed = time.perf_counter() - start
+    ok = digest(world) == recording.digest
+    print('{} keys, {} steps in {:.3f}s ({:.0f} steps/sec)'.format(
+        len(recording.inputs), world.steps, elapsed, world.steps / max(elapsed, 1e-9)))
+    print('level {} mode {} tick {}, {} goals left'.format(
+        world.mapindex, world.mode, world.ticks, world.goals.left()))
+    if world.player is not None and world.player in world.cells:
+        print('player at {}'.format(world.locate(world.player)))
+    print('digest {} ({})'.format(digest(world).hex(), 'ok' if ok else 'MISMATCH'))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1056 @@
+"""Puzzle rules, independent of pyglet.
+
+Everything here can be stepped without a window or an audio device; the game
+in __main__ subclasses these entities to attach sprites and sounds.
+"""
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import heapq
+import itertools
+from types import MappingProxyType
+
+from . import maps
+from . import telemetry
+
+
+class Dir:
+    sw, w, nw, s, none, n, se, e, ne = itertools.product(range(-1, 2), repeat=2)
+
+movement = {
+    'h': Dir.w,
+    'j': Dir.s,
+    'k': Dir.n,
+    'l': Dir.e,
+    'a': Dir.w,
+    's': Dir.s,
+    'w': Dir.n,
+    'd': Dir.e,
+}
+_push = [5, 5, 5, 5, 5, 4, 4, 4, 3, 3, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1]
+#_push = [5, 5, 5, 4, 4, 4, 3, 3, 3, 2, 2, 2, 1, 1, 1]
+_bounce = [4, -2, -1, -1]
+# The actions of an object that has never had any, shared by all of them.
+_noactions = MappingProxyType({})
+gridsize = sum(_push)
+width, height = 1280, 720
+gridwidth = width // gridsize
+gridheight = height // gridsize
+gridxoffset = (width - gridwidth * gridsize) // 2 + gridsize // 2
+gridyoffset = (height - gridheight * gridsize) // 2 + gridsize // 2
+# Pixel sizes of the art in art/*.png, so collisions match the game exactly.
+tilesize = (64, 64)
+fishsize = (64, 40)
+# What World.statics holds for each cell.
+opentile, walltile, bwalltile = 0, 1, 2
+statictiles = {'#': walltile, '%': bwalltile}
+# The world is split into squares of chunksize cells, which a view shows or
+# hides together.
+chunksize = 16
+
+
+def chunkof(x, y):
+    """The chunk holding pixel (x, y) of the world."""
+    span = chunksize * gridsize
+    return x // span, y // span
+
+
+def overlaps(a, b):
+    """Whether the collision rects of a and b overlap.
+
+    A collision rect starts at (x - width // 2, y - height // 2) and is 24px
+    narrower and shorter than the object.
+    """
+    ax = a._x - a.width // 2
+    bx = b._x - b.width // 2
+    if not (ax < bx + b.width - 24 and bx < ax + a.width - 24):
+        return False
+    ay = a._y - a.height // 2
+    by = b._y - b.height // 2
+    return ay < by + b.height - 24 and by < ay + a.height - 24
+
+
+class BroadPhase:
+    """Uniform grid of buckets over the collision rects of collidables.
+
+    near(obj) only returns collidables sharing a bucket with obj's rect, so
+    the exact overlap test runs on a handful of candidates instead of on every
+    collidable in the world.
+    """
+    def __init__(self, cellsize):
+        self.cellsize = cellsize
+        self.buckets = defaultdict(dict)
+        self.keys = {}
+
+    def add(self, obj):
+        keys = self.keys[obj] = self.keysof(obj)
+        for key in keys:
+            self.buckets[key][obj] = None
+
+    def keysof(self, obj):
+        size = self.cellsize
+        left = obj._x - obj.width // 2
+        bottom = obj._y - obj.height // 2
+        x0, x1 = left // size, (left + obj.width - 25) // size
+        y0, y1 = bottom // size, (bottom + obj.height - 25) // size
+        if x0 == x1 and y0 == y1:
+            return ((x0, y0),)
+        return tuple(
+            (bx, by) for bx in range(x0, x1 + 1) for by in range(y0, y1 + 1)
+        )
+
+    def move(self, obj):
+        keys = self.keysof(obj)
+        if keys != self.keys[obj]:
+            self.remove(obj)
+            self.add(obj)
+
+    def near(self, obj):
+        found = {}
+        for key in self.keysof(obj):
+            found.update(self.buckets.get(key, ()))
+        return found
+
+    def remove(self, obj):
+        for key in self.keys.pop(obj):
+            bucket = self.buckets[key]
+            del bucket[obj]
+            if not bucket:
+                del self.buckets[key]
+
+
+class Animated:
+    """Cycles through nframes frames, delay ticks apiece; both are set by
+    the class, and the class using it declares the frame and paused slots.
+
+    Only objects in the chunks the world shows are animated. Elsewhere the
+    animation stops and is parked until World.show() brings its chunk on
+    screen, or the object moves onto it."""
+    __slots__ = ()
+    nframes = 1
+    delay = 1
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs, width=tilesize[0], height=tilesize[1])
+
+    def setup(self, **kwargs):
+        super().setup(**kwargs)
+        self.frame = 0
+        self.paused = False
+        self.show_frame(self.frame)
+        self.act(self.animate_iter(), id='animation')
+
+    def place(self, x, y):
+        super().place(x, y)
+        world = self.world
+        if world is not None and 'animation' not in self.actions and \
+                chunkof(x, y) in world.shown and self in world.cells:
+            self.act(self.animate_iter(), id='animation')
+
+    def animate_iter(self):
+        world = self.world
+        while True:
+            chunk = chunkof(self.x, self.y)
+            if chunk not in world.shown:
+                world.parked[chunk][self] = None
+                return
+            if not self.paused:
+                self.frame = (self.frame + 1) % self.nframes
+                self.show_frame(self.frame)
+            yield self.delay
+
+    def pause_animation(self):
+        self.paused = True
+
+    def show_frame(self, frame):
+        pass
+
+
+class Task:
+    """An object's action, run by the world's Scheduler.
+
+    The coroutine yields None to be resumed on the next tick, a number n to
+    sleep for n ticks, or another Task to wait until that one has finished or
+    been cancelled.
+    """
+    __slots__ = ('coroutine', 'owner', 'id', 'cancelled', 'done', 'waiters', 'scheduler')
+
+    def __init__(self, coroutine, *, owner=None, id=None):
+        self.coroutine = coroutine
+        self.owner = owner
+        self.id = id
+        self.cancelled = False
+        self.done = False
+        self.waiters = ()
+        self.scheduler = None
+
+    def cancel(self):
+        """Stop the task; anything waiting on it carries on next tick."""
+        self.cancelled = True
+        waiters, self.waiters = self.waiters, ()
+        for waiter in waiters:
+            waiter.scheduler.start(waiter)
+
+    def finish(self):
+        self.done = True
+        if self.owner is not None and self.owner.actions.get(self.id) is self:
+            del self.owner.actions[self.id]
+
+
+class Scheduler:
+    """A queue of tasks ordered by the tick they next want to run on.
+
+    Each tick only the tasks that are due are resumed, so an object that is
+    sleeping, waiting on another task or has nothing to do costs nothing.
+    Ties go to whichever task was queued first.
+    """
+    def __init__(self):
+        self.queue = []
+        self.now = 0
+        self.running = False
+        self._seq = itertools.count()
+
+    def start(self, task):
+        """Run task from the next tick that hasn't started yet."""
+        task.scheduler = self
+        self._push(task, self.now + 1 if self.running else self.now)
+
+    def run(self):
+        """Resume every task that is due, then move on to the next tick."""
+        self.running = True
+        queue = self.queue
+        while queue and queue[0][0] <= self.now:
+            _, _, task = heapq.heappop(queue)
+            if task.cancelled:
+                continue
+            try:
+                wait = next(task.coroutine)
+            except StopIteration:
+                task.finish()
+                for waiter in task.waiters:
+                    self._push(waiter, self.now + 1)
+                task.waiters = ()
+                continue
+            if wait is None:
+                self._push(task, self.now + 1)
+            elif isinstance(wait, Task):
+                if wait.done or wait.cancelled:
+                    self._push(task, self.now + 1)
+                else:
+                    wait.waiters += (task,)
+            else:
+                self._push(task, self.now + max(1, wait))
+        self.running = False
+        self.now += 1
+
+    def _push(self, task, tick):
+        heapq.heappush(self.queue, (tick, next(self._seq), task))
+
+
+class Collidable:
+    __slots__ = ()
+
+    def collide(self, other):
+        raise NotImplementedError
+
+    def delete(self):
+        del self.world.collidables[self]
+        self.world.broadphase.remove(self)
+        super().delete()
+
+    def enter_world(self, world):
+        super().enter_world(world)
+        self.world.collidables[self] = None
+        self.world.broadphase.add(self)
+
+    def place(self, x, y):
+        super().place(x, y)
+        if self.world is not None and self in self.world.collidables:
+            self.world.broadphase.move(self)
+
+
+class Goal:
+    """Something the level waits on; it is complete once every goal is done.
+
+    Goals join the world's Goals tracker when they enter the world and must
+    call world.goals.update(self) whenever is_done() may have changed. A goal
+    standing for several things, like a FieldGrid, says how many are left
+    through left().
+    """
+    __slots__ = ()
+
+    def enter_world(self, world):
+        super().enter_world(world)
+        world.goals.add(self)
+
+    def is_done(self):
+        raise NotImplementedError
+
+    def left(self):
+        return 0 if self.is_done() else 1
+
+
+class Goals:
+    """The goals in a level that aren't done yet.
+
+    Instead of asking every object each tick, the tracker is told when a goal
+    changes, and calls each of its listeners when the last one is done.
+    """
+    def __init__(self):
+        self.unfinished = {}
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.unfinished)
+
+    def left(self):
+        """How many things are still to do, counting each field of a FieldGrid."""
+        return sum(obj.left() for obj in self.unfinished)
+
+    def add(self, obj):
+        if not obj.is_done():
+            self.unfinished[obj] = None
+
+    def discard(self, obj):
+        if self.unfinished.pop(obj, False) is None and not self.unfinished:
+            self._notify()
+
+    def update(self, obj):
+        if obj.is_done():
+            self.discard(obj)
+        else:
+            self.unfinished[obj] = None
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener()
+
+
+class GridCollidable:
+    __slots__ = ()
+
+    def grid_collide(self, other):
+        raise NotImplementedError
+
+
+class Obj:
+    """Something on the grid.
+
+    Levels can hold tens of thousands of these, so every class of them
+    declares __slots__, mixins included, and an object only gets an actions
+    dict once it acts. parts, the sprites and such that follow the object
+    around, is an empty tuple in the simulation.
+    """
+    __slots__ = (
+        'width', 'height', 'name', 'parts', '_x', '_y', 'world', 'actions', '_nextid',
+        'deleted', 'disable_collision')
+
+    def __init__(self, *, name=None, width, height, **kwargs):
+        super().__init__()
+        self.width, self.height = width, height
+        self.name = name
+        self.parts = ()
+        self.setup(**kwargs)
+
+    def setup(self):
+        """Start a fresh life; World.make() calls this again on pooled objects."""
+        self._x, self._y = 0, 0
+        self.world = None
+        self.actions = _noactions
+        self._nextid = 0
+        self.deleted = False
+        self.disable_collision = False
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    def act(self, iterator, *, id=None):
+        """Start an action, replacing any running one with the same id."""
+        if id is None:
+            id = self._nextid
+            self._nextid += 1
+        if self.actions is _noactions:
+            self.actions = {}
+        old = self.actions.get(id)
+        if old is not None:
+            old.cancel()
+        task = self.actions[id] = Task(iterator, owner=self, id=id)
+        if self.world is not None:
+            self.world.scheduler.start(task)
+        return task
+
+    def check_collisions(self):
+        if not self.disable_collision:
+            world = self.world
+            nearby = world.broadphase.near(self)
+            touching = world.touching.get(self)
+            if touching:
+                # Anything touched last time but outside the broad phase now
+                # has moved away, so forget it to let it collide again later.
+                for obj in list(touching):
+                    if obj not in nearby:
+                        del touching[obj]
+            for obj in nearby:
+                if obj is self:
+                    continue
+                if world.collides(self, obj):
+                    obj.collide(self)
+        for obj in self.world.at(self.world.locate(self), 'gridcollidable'):
+            if obj is not self:
+                obj.grid_collide(self)
+
+    def delete(self):
+        self.act(self.delete_iter(), id='delete')
+
+    def delete_iter(self):
+        for _ in range(3):
+            for part in self.parts:
+                part.scale += 1
+                part.opacity -= 64
+            yield
+        self.world.recycle(self)
+
+    def enter_world(self, world):
+        self.world = world
+        for task in self.actions.values():
+            world.scheduler.start(task)
+
+    def is_done(self):
+        return True
+
+    def retire(self):
+        """Leave play; the object waits in its world's pool until reused."""
+        self.deleted = True
+
+    def place(self, x, y):
+        world = self.world
+        # Whatever this stops touching has to notice, as well as whatever it
+        # starts touching.
+        if world is not None:
+            world.wake_near(self)
+        for part in self.parts:
+            if hasattr(part, 'place'):
+                part.place(x, y)
+            else:
+                part.x = x
+                part.y = y
+        self._x = x
+        self._y = y
+        if world is not None:
+            world.wake_near(self)
+
+
+class Fish(Obj):
+    __slots__ = ('direction', 'frozen')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs, width=fishsize[0], height=fishsize[1])
+
+    def setup(self, **kwargs):
+        super().setup(**kwargs)
+        self.direction = 'left'
+        self.frozen = False
+        self.show_facing(self.direction)
+
+    def check_collisions(self):
+        world = self.world
+        if world.fieldgrid is not None and not self.disable_collision:
+            for loc in world.fieldgrid.touch(self):
+                world.advance_field(loc)
+        super().check_collisions()
+
+    def face(self, direction):
+        dx, _ = direction
+        if dx == 0:
+            return
+        elif dx < 0:
+            newdir = 'left'
+        elif dx > 0:
+            newdir = 'right'
+        if newdir != self.direction:
+            self.act(self.face_iter(newdir), id='face')
+            self.direction = newdir
+
+    def face_iter(self, dir):
+        self.show_facing('front')
+        yield
+        yield
+        self.show_facing(dir)
+
+    def move(self, dir):
+        if self.world.try_move(self, dir):
+            self.act(self.move_iter(dir, _push))
+            return True
+        else:
+            self.act(self.move_iter(dir, _bounce))
+            return False
+
+    def move_iter(self, dir, amounts):
+        for amount in amounts:
+            dx, dy = dir
+            new_x = self.x + dx*amount
+            new_y = self.y + dy*amount
+            self.place(new_x, new_y)
+            yield
+
+    def show_facing(self, direction):
+        pass
+
+
+class Field(Collidable, Goal, Obj):
+    __slots__ = ('state',)
+    nstates = 3
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs, width=tilesize[0], height=tilesize[1])
+
+    def setup(self, *, state=0, **kwargs):
+        super().setup(**kwargs)
+        self.state = state
+        self.show_state(state)
+
+    def advance(self):
+        self.state = (self.state + 1) % self.nstates
+        self.world.playsounds('blip')
+        self.show_state(self.state)
+        self.world.goals.update(self)
+
+    def collide(self, other):
+        if isinstance(other, Fish):
+            self.advance()
+
+    def is_done(self):
+        return self.state == 2
+
+    def show_state(self, state):
+        pass
+
+
+Baked = namedtuple('Baked', 'key width height statics walls cells')
+Baked.__doc__ = """The parts of a level that never change, worked out once per map.
+
+statics holds a tile per cell, row by row from the bottom; walls lists
+((col, row), tile) for each wall and bubble wall; cells lists the rest of the
+map's occupied cells, to be spawned as objects.
+"""
+
+
+class Bubble(Animated, Collidable, GridCollidable, Obj):
+    __slots__ = ('frame', 'paused', 'captured')
+    nframes = 6
+    delay = 3
+
+    def setup(self, **kwargs):
+        super().setup(**kwargs)
+        self.captured = None
+
+    def collide(self, other):
+        if other == self.captured:
+            other.disable_collision = True
+            self.act(self.rise_iter(), id='rise')
+
+    def grid_collide(self, other):
+        # A bubble carries one fish once; it lingers while it pops, and
+        # catching the fish again then would leave it stuck for good.
+        if isinstance(other, Fish) and not other.frozen and self.captured is None:
+            other.frozen = True
+            self.captured = other
+
+    def rise_iter(self):
+        while True:
+            if self.world.try_move(self.captured, Dir.n):
+                self.world.playsounds('bubble')
+                for _ in zip(
+                    Fish.move_iter(self, Dir.n, _push),
+                    self.captured.move_iter(Dir.n, _push),
+                ):
+                    yield
+            else:
+                break
+        self.captured.frozen = False
+        self.captured.disable_collision = False
+        self.world.wake(self.captured)
+        self.delete()
+        self.world.playsounds('pop')
+
+
+class Star(Animated, Collidable, Obj):
+    __slots__ = ('frame', 'paused', 'captured')
+    nframes = 2
+    delay = 10
+
+    def setup(self, **kwargs):
+        super().setup(**kwargs)
+        self.captured = None
+
+    def collide(self, other):
+        if isinstance(other, Fish) and not other.frozen:
+            self.world.playsounds('star')
+            self.delete()
+
+
+class World:
+    """The grid and everything on it, advanced one tick at a time by step().
+
+    Grid cells and the collidable registry are insertion-ordered dicts rather
+    than sets so that two runs fed the same input behave identically.
+
+    Only awake objects check for collisions each tick. An object wakes when it
+    moves, when something near it moves, when something enters its cell, or
+    when wake() is called on it, and sleeps again once it has checked; nothing
+    can start or stop touching a sleeping object, so a level full of fields
+    costs nothing while the fish sits still.
+
+    Alongside the grid the world keeps a reverse index from each object to its
+    cell, and one layer per entry in `layers` mapping cells to the objects of
+    that kind, so that locating an object does not scan the grid.
+
+    Walls and bubble walls never move or change, so they aren't objects: each
+    map is baked once into a Baked whose statics, one byte per cell, try_move
+    reads directly. The last `maxbaked` maps are kept, keyed by a hash of the
+    map, so resetting a level or coming back to it skips the work.
+
+    With fieldgrid, fields are kept in a fieldgrid.FieldGrid rather than as
+    Field objects, which needs NumPy.
+
+    With prefetch, each reset starts baking the next level on a worker
+    thread, and `upcoming` holds (key, future) for it. Running stage_iter() on
+    its Baked between frames then readies that level's objects, so moving on
+    to it neither parses the map nor builds anything that could be built
+    before.
+    """
+    Fish = Fish
+    Field = Field
+    Bubble = Bubble
+    Star = Star
+    maxbaked = 64
+    layers = {
+        'field': Field,
+        'collidable': Collidable,
+        'gridcollidable': GridCollidable,
+    }
+
+    def __init__(self, *, maps, width=gridwidth, height=gridheight, fieldgrid=False,
+                 prefetch=False):
+        self.grid = defaultdict(dict)
+        self.minwidth = width
+        self.minheight = height
+        self.cells = {}
+        self.layered = {name: {} for name in self.layers}
+        self._layersof = {}
+        self.width = width
+        self.height = height
+        self.statics = bytearray(width * height)
+        self.walls = []
+        self.baked = None
+        self.bakes = OrderedDict()
+        self.maps = maps
+        self.mapindex = -1
+        self.mode = 'stop'
+        self.collidables = {}
+        self.broadphase = BroadPhase(gridsize)
+        self.touching = defaultdict(dict)
+        self.awake = {}
+        self.spawning = False
+        self.scheduler = Scheduler()
+        self.shown = set()
+        self.parked = defaultdict(dict)
+        self.goals = Goals()
+        self.goals.listeners.append(self._goals_met)
+        self.goals_met = False
+        self.player = None
+        self.moved_this_update = False
+        self.ticks = 0
+        self.steps = 0
+        self.inputs = None
+        self.pool = defaultdict(list)
+        self.timings = telemetry.NullTimings()
+        self.fieldgrid = None
+        if fieldgrid:
+            from .fieldgrid import FieldGrid
+            self.fieldgrid = FieldGrid()
+        self.staged = {}
+        self.upcoming = None
+        self.prefetcher = None
+        if prefetch:
+            self.prefetcher = ThreadPoolExecutor(1, thread_name_prefix='prefetch')
+
+    def reset(self):
+        for obj in self.objs():
+            self._retire(obj)
+        self.mode = 'go'
+        self.grid = defaultdict(dict)
+        self.cells = {}
+        self.layered = {name: {} for name in self.layers}
+        self.collidables = {}
+        self.broadphase = BroadPhase(gridsize)
+        self.touching = defaultdict(dict)
+        self.awake = {}
+        self.scheduler = Scheduler()
+        self.parked = defaultdict(dict)
+        self.goals = Goals()
+        self.goals.listeners.append(self._goals_met)
+        self.moved_this_update = False
+        self.ticks = 0
+        # Everything checks on the first tick, so don't bother waking things
+        # one by one as they are spawned.
+        self.spawning = True
+        self.player = self.make(self.Fish, name='T. Jefferson')
+        baked = self.baked = self.bake(self.maps[self.mapindex])
+        self.width, self.height = baked.width, baked.height
+        self.statics = baked.statics
+        self.walls = baked.walls
+        cells = baked.cells
+        if self.fieldgrid is not None:
+            fields = [(loc, 'yrp'.index(char)) for loc, char in cells if char in 'yrp']
+            self.fieldgrid.reset(self.width, self.height, fields)
+            cells = [(loc, char) for loc, char in cells if char not in 'yrp']
+            self.goals.add(self.fieldgrid)
+        for (gx, gy), char in cells:
+            if char == 's':
+                self.put(self.player, gx, gy)
+            else:
+                kind = self.kind(char)
+                if kind is not None:
+                    self.spawn(kind[0], gx, gy, **kind[1])
+        self.spawning = False
+        self.awake = dict.fromkeys(self.cells)
+        self.goals_met = not self.goals
+        self.playsounds('reset')
+        if self.prefetcher is not None and self.mapindex + 1 < len(self.maps):
+            self.prefetch(self.mapindex + 1)
+        # Whatever was staged for a level that isn't next goes back in the pool.
+        upcoming = self.upcoming[0] if self.upcoming is not None else None
+        for stagedkey in [stagedkey for stagedkey in self.staged if stagedkey[0] != upcoming]:
+            obj = self.staged.pop(stagedkey)
+            self.pool[type(obj), obj.name].append(obj)
+
+    def bake(self, map):
+        """The Baked for map, from the cache if it has been seen lately."""
+        key = maps.key(map)
+        baked = self.bakes.get(key)
+        if baked is not None:
+            self.bakes.move_to_end(key)
+            return baked
+        if self.upcoming is not None and self.upcoming[0] == key:
+            baked = self.upcoming[1].result()
+            self.upcoming = None
+        else:
+            baked = self._bake(key, map)
+        self.bakes[key] = baked
+        if len(self.bakes) > self.maxbaked:
+            self.bakes.popitem(last=False)
+        return baked
+
+    def _bake(self, key, map):
+        # This runs on the prefetch thread, so it mustn't touch the world.
+        cells = [(loc, char) for loc, char in maps.parse(map) if char != ' ']
+        # The world is at least as big as the screen, and grows to fit a
+        # bigger map; the game scrolls to follow the fish around it.
+        width = max([self.minwidth] + [gx + 1 for (gx, _), _ in cells])
+        height = max([self.minheight] + [gy + 1 for (_, gy), _ in cells])
+        statics = bytearray(width * height)
+        walls = []
+        for (gx, gy), char in cells:
+            tile = statictiles.get(char)
+            if tile is not None:
+                statics[gy * width + gx] = tile
+                walls.append(((gx, gy), tile))
+        return Baked(
+            key, width, height, bytes(statics), walls,
+            [(loc, char) for loc, char in cells if char not in statictiles])
+
+    def prefetch(self, index):
+        """Start baking level index on the prefetch thread."""
+        map = self.maps[index]
+        key = maps.key(map)
+        if self.upcoming is not None and self.upcoming[0] == key:
+            return
+        baked = self.bakes.get(key)
+        if baked is not None:
+            future = Future()
+            future.set_result(baked)
+        else:
+            future = self.prefetcher.submit(self._bake, key, map)
+        self.upcoming = key, future
+
+    def stage_iter(self, baked):
+        """Ready the objects baked spawns, one per iteration.
+
+        Each is taken from the pool or made, retired and placed on its cell,
+        then kept in `staged` until a reset to that level spawns that cell;
+        anything it has to build is built before the level starts rather
+        than as it starts.
+        """
+        for (gx, gy), char in baked.cells:
+            if (baked.key, gx, gy) in self.staged:
+                continue
+            if self.fieldgrid is not None and char in 'yrp':
+                continue
+            kind = self.kind(char)
+            if kind is None:
+                continue
+            # Not make(), which would set up a pooled object to show it;
+            # that waits until the spawn, and staged objects stay hidden.
+            pool = self.pool[kind[0], None]
+            obj = pool.pop() if pool else kind[0](**kind[1])
+            obj.retire()
+            obj.place(gx * gridsize + gridxoffset, gy * gridsize + gridyoffset)
+            self.staged[baked.key, gx, gy] = obj
+            yield
+
+    def collides(self, a, b):
+        """Whether a has just started overlapping b.
+
+        The pair is remembered until they stop overlapping, so a collision is
+        only reported once per contact.
+        """
+        if overlaps(a, b):
+            touching = self.touching[a]
+            if b in touching:
+                return False
+            else:
+                touching[b] = None
+                return True
+        else:
+            # Only objects that have touched something get an entry.
+            touching = self.touching.get(a)
+            if touching and b in touching:
+                del touching[b]
+            return False
+
+    def complete_level(self):
+        self.mode = 'stop'
+        self.playsounds('complete')
+
+    def is_complete(self):
+        return not self.goals
+
+    def advance_field(self, loc):
+        """Advance the field at loc in the field grid."""
+        state = self.fieldgrid.advance(loc)
+        self.playsounds('blip')
+        self.show_field(loc, state)
+        self.goals.update(self.fieldgrid)
+
+    def at(self, loc, layer):
+        """The objects in the given layer at loc, without touching the grid."""
+        return self.layered[layer].get(loc, ())
+
+    def layersof(self, obj):
+        kind = type(obj)
+        try:
+            return self._layersof[kind]
+        except KeyError:
+            names = self._layersof[kind] = tuple(
+                name for name, base in self.layers.items() if issubclass(kind, base)
+            )
+            return names
+
+    def kind(self, char):
+        """The type and setup arguments of what char spawns, bar the fish."""
+        if char == 'y':
+            return self.Field, {'state': 0}
+        elif char == 'r':
+            return self.Field, {'state': 1}
+        elif char == 'p':
+            return self.Field, {'state': 2}
+        elif char == 'o':
+            return self.Bubble, {}
+        elif char == '*':
+            return self.Star, {}
+        return None
+
+    def locate(self, obj):
+        try:
+            return self.cells[obj]
+        except KeyError:
+            raise ValueError('{!r} is not in the grid'.format(obj)) from None
+
+    def make(self, type, *, name=None, **kwargs):
+        """A new object of type, reusing a retired one if there is one.
+
+        Objects that leave play (deleted or left over from the last reset) are
+        kept per type and name, so a reset mostly rebinds existing objects and
+        their sprites instead of building new ones.
+        """
+        pool = self.pool[type, name]
+        if pool:
+            obj = pool.pop()
+            obj.setup(**kwargs)
+            return obj
+        return type(name=name, **kwargs)
+
+    def static(self, loc):
+        """The tile at loc: opentile, walltile or bwalltile."""
+        gx, gy = loc
+        return self.statics[gy * self.width + gx]
+
+    def neighbors(self, obj):
+        return [o for o in self.grid.get(self.locate(obj), ()) if o is not obj]
+
+    def objs(self):
+        return list(itertools.chain.from_iterable(map(list, self.grid.values())))
+
+    def playsounds(self, *names):
+        pass
+
+    def show_field(self, loc, state):
+        pass
+
+    def finish(self):
+        self.mode = 'finished'
+
+    def goto(self, index):
+        """Start level index, or finish the game if there isn't one."""
+        self.mapindex = index
+        if self.mapindex < len(self.maps):
+            self.reset()
+        else:
+            self.finish()
+
+    def press(self, text):
+        """Handle a key, from the title screen to the last level.
+
+        If inputs is a list, each key is appended to it along with the number
+        of steps taken so far, which is enough to replay the session.
+        """
+        if self.inputs is not None:
+            self.inputs.append((self.steps, text))
+        if self.mode == 'stop' and text in [' ', '\r']:
+            self.goto(self.mapindex + 1)
+        elif self.mode == 'go' and text == '[':
+            self.goto(max(self.mapindex - 1, 0))
+        elif self.mode == 'go' and text == ']':
+            self.goto(min(self.mapindex + 1, len(self.maps) - 1))
+        elif self.mode != 'go':
+            return
+        elif text in movement:
+            if not self.player.frozen and not self.moved_this_update:
+                self.player.move(movement[text])
+                self.moved_this_update = True
+            self.player.face(movement[text])
+        elif text == 'r':
+            self.mode = 'reset'
+
+    def put(self, obj, gx, gy):
+        self._insert(obj, (gx, gy))
+        obj.enter_world(self)
+        x = gx * gridsize + gridxoffset
+        y = gy * gridsize + gridyoffset
+        obj.place(x, y)
+
+    def recycle(self, obj):
+        """Take obj out of play and keep it for make() to hand out again."""
+        self.remove(obj)
+        self._retire(obj)
+
+    def remove(self, obj):
+        self._discard(obj, self.locate(obj))
+        self.awake.pop(obj, None)
+        self.goals.discard(obj)
+        for task in obj.actions.values():
+            task.cancel()
+        obj.actions = _noactions
+
+    def spawn(self, type, gx, gy, **kwargs):
+        obj = self.staged.pop((self.baked.key, gx, gy), None) if self.staged else None
+        if obj is None:
+            obj = self.make(type, **kwargs)
+        else:
+            obj.setup(**kwargs)
+        self.put(obj, gx, gy)
+
+    def step(self):
+        timings = self.timings
+        if self.mode == 'reset':
+            self.reset()
+        with timings.phase('update.actions'):
+            self.scheduler.run()
+        with timings.phase('update.collisions'):
+            awake, self.awake = self.awake, {}
+            cells = self.cells
+            for obj in awake:
+                if obj in cells:
+                    obj.check_collisions()
+        with timings.phase('update.complete'):
+            if self.goals_met:
+                # A goal can be undone later in the tick that finished the
+                # last one, so only trust the event once the tick is over.
+                self.goals_met = False
+                if self.mode == 'go' and self.is_complete():
+                    self.complete_level()
+        self.moved_this_update = False
+        self.ticks += 1
+        self.steps += 1
+
+    def show(self, chunks):
+        """Animate the objects in chunks, and only those, from now on.
+
+        A view calls this with the chunks on screen. Animations in chunks it
+        stops showing end at their next frame and wait in `parked`; a world
+        nobody shows runs none.
+        """
+        chunks = set(chunks)
+        for chunk in chunks - self.shown:
+            for obj in self.parked.pop(chunk, ()):
+                if obj in self.cells and 'animation' not in obj.actions:
+                    obj.act(obj.animate_iter(), id='animation')
+        self.shown = chunks
+
+    def wake(self, obj):
+        """Have obj check for collisions on the next pass."""
+        self.awake[obj] = None
+
+    def wake_near(self, obj):
+        """Wake obj and the collidables near it."""
+        if self.spawning:
+            return
+        self.awake[obj] = None
+        self.awake.update(self.broadphase.near(obj))
+
+    def try_move(self, obj, dir):
+        dx, dy = dir
+        gx, gy = self.locate(obj)
+        nx = gx + dx
+        ny = gy + dy
+        if 0 <= nx < self.width and 0 <= ny < self.height:
+            tile = self.statics[ny * self.width + nx]
+            if tile == walltile or tile == bwalltile and not obj.frozen:
+                return False
+            self._discard(obj, (gx, gy))
+            self._insert(obj, (nx, ny))
+            # Everything in the new cell, obj included.
+            self.awake.update(self.grid[nx, ny])
+            return True
+        else:
+            return False
+
+    def _retire(self, obj):
+        obj.retire()
+        self.pool[type(obj), obj.name].append(obj)
+
+    def _goals_met(self):
+        self.goals_met = True
+
+    def _discard(self, obj, loc):
+        objs = self.grid[loc]
+        del objs[obj]
+        if not objs:
+            del self.grid[loc]
+        del self.cells[obj]
+        for name in self.layersof(obj):
+            layer = self.layered[name]
+            layer[loc].remove(obj)
+            if not layer[loc]:
+                del layer[loc]
+
+    def _insert(self, obj, loc):
+        self.grid[loc][obj] = None
+        self.cells[obj] = loc
+        for name in self.layersof(obj):
+            self.layered[name].setdefault(loc, []).append(obj)
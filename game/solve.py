@@ -0,0 +1,782 @@
+"""Find the shortest sequence of moves that turns every field purple.
+
+    python -m game.solve [LEVEL ...] [--stars] [--check] [--seconds N]
+
+Levels are indices into maps.maps (all of them by default). The search works
+on the rules as they play out on the grid rather than on pixels:
+
+* moving onto a field advances it (yellow -> red -> purple -> yellow);
+* walls stop the fish, and bubble walls stop it unless it is in a bubble;
+* moving onto a bubble captures the fish, which then floats north through
+  bubble walls until it hits a wall or the top of the world. Nothing it
+  passes on the way is touched, and the bubble is used up. Where it lands
+  it touches the field or star there as if it had just moved in; landing on
+  another bubble leaves it stuck for good. A bubble that cannot rise at all
+  just pops and leaves the fish where it is;
+* moving onto a star collects it.
+
+A search state is packed into one int: the fish's cell, two bits per field,
+one bit per bubble and one per star.
+
+Before searching, the solver tries to build a route on foot from how often
+each cell has to be visited. If that route is as short as the search's lower
+bound, it is the answer; if not, it is what the solver offers when the
+search runs out of states or time.
+"""
+import argparse
+from collections import Counter, defaultdict, namedtuple
+import heapq
+import itertools
+import random
+import time
+
+from . import maps
+from .sim import Dir, gridheight, gridwidth
+
+# Keys from sim.movement, one per direction.
+keys = {Dir.w: 'h', Dir.s: 'j', Dir.n: 'k', Dir.e: 'l'}
+
+# explored counts the states the search expanded or, for a route built from
+# visit counts, the visit counts tried.
+Solution = namedtuple('Solution', 'moves explored')
+
+
+class GaveUp(Exception):
+    """The search hit its limit before finding a solution or ruling one out.
+
+    explored is how many states it expanded, and moves is a winning route
+    that may not be the shortest, or None.
+    """
+
+    def __init__(self, message, explored, moves=None):
+        super().__init__(message)
+        self.explored = explored
+        self.moves = moves
+
+
+class Level:
+    """A map compiled to flat tables the solver can index by cell number."""
+
+    def __init__(self, map, *, width=gridwidth, height=gridheight):
+        self.width, self.height = width, height
+        self.cells = {}
+        self.walls, self.bwalls = set(), set()
+        fields, bubbles, stars = [], [], []
+        self.start = None
+        for loc, char in maps.parse(map):
+            if char == ' ':
+                continue
+            # Like World, grow to fit a map bigger than the screen.
+            self.width = max(self.width, loc[0] + 1)
+            self.height = max(self.height, loc[1] + 1)
+            if char == '#':
+                self.walls.add(loc)
+            elif char == '%':
+                self.bwalls.add(loc)
+            elif char in 'yrp':
+                fields.append((loc, 'yrp'.index(char)))
+            elif char == 'o':
+                bubbles.append(loc)
+            elif char == '*':
+                stars.append(loc)
+            elif char == 's':
+                self.start = loc
+        if self.start is None:
+            raise ValueError('map has no starting point')
+
+        self.locs = []
+        self.field = []
+        self.bubble = []
+        self.star = []
+        for loc in itertools.chain((loc for loc, _ in fields), bubbles, stars):
+            self.index(loc)
+        # Only open cells the fish can reach get an index, so the tables stay
+        # small on big maps.
+        bubbleset = set(bubbles)
+        seen = self.reach(bubbleset)
+        for loc in seen:
+            self.index(loc)
+        for loc in bubbles:
+            self.index(self.rise(loc))
+        for i, (loc, _) in enumerate(fields):
+            self.field[self.cells[loc]] = 2 * i
+        for i, loc in enumerate(bubbles):
+            self.bubble[self.cells[loc]] = 1 << i
+        for i, loc in enumerate(stars):
+            self.star[self.cells[loc]] = 1 << i
+
+        self.nfields = len(fields)
+        self.nbubbles = len(bubbles)
+        self.nstars = len(stars)
+        self.posbits = max(1, (len(self.locs) - 1).bit_length())
+        self.posmask = (1 << self.posbits) - 1
+        self.fieldshift = self.posbits
+        self.bubbleshift = self.fieldshift + 2 * self.nfields
+        self.starshift = self.bubbleshift + self.nbubbles
+        self.moves = [
+            [(key, self.cells.get(self.step(loc, dir, frozen=False)))
+             for dir, key in keys.items()]
+            for loc in self.locs
+        ]
+        landings = {self.rise(loc) for loc in bubbles}
+        # For fields only ever entered on foot: the fields around them, and
+        # whether the neighbours are all fields ('fields'), all plain open
+        # cells ('open') or a mix.
+        self.surroundings = []
+        for i, (loc, _) in enumerate(fields):
+            if loc not in seen or loc in landings:
+                continue
+            cell = self.cells[loc]
+            dests = [dest for _, dest in self.moves[cell] if dest is not None]
+            around = [self.field[dest] for dest in dests]
+            if all(shift is not None for shift in around):
+                kind = 'fields'
+            elif not any(shift is not None or self.bubble[dest]
+                         for shift, dest in zip(around, dests)):
+                kind = 'open'
+            else:
+                kind = None
+            self.surroundings.append((
+                cell,
+                self.fieldshift + 2 * i,
+                1 - sum(loc) % 2,
+                [self.fieldshift + shift for shift in around if shift is not None],
+                kind if dests else 'closed',
+            ))
+        self.adjacent = [
+            {dest for _, dest in moves if dest is not None} for moves in self.moves
+        ]
+        self.landing = [
+            self.cells[self.rise(loc)] if self.bubble[i] else None
+            for i, loc in enumerate(self.locs)
+        ]
+        fieldstate = sum(state << 2 * i for i, (_, state) in enumerate(fields))
+        self.initial = (
+            self.cells[self.start] |
+            fieldstate << self.fieldshift |
+            ((1 << self.nbubbles) - 1) << self.bubbleshift |
+            ((1 << self.nstars) - 1) << self.starshift
+        )
+        self.goal = sum(2 << 2 * i for i in range(self.nfields))
+        self.fieldmask = (1 << 2 * self.nfields) - 1
+        self.bubblemask = (1 << self.nbubbles) - 1
+        self.fieldlocs = [loc for loc, _ in fields]
+        self.colour = [sum(loc) % 2 for loc in self.locs]
+        # Bubbles that drop the fish on a field it can never leave: riding one
+        # ends the game, so while that field still needs its visit the rest
+        # of the route is pinned to finish next to the bubble, and never
+        # passes through it.
+        traps = {}
+        for loc in bubbles:
+            land = self.rise(loc)
+            if self.field[self.cells[land]] is not None and land != loc and not any(
+                    self.step(land, dir, frozen=False) for dir in keys):
+                traps[loc] = land
+        self.padding = self.paddable(seen, traps)
+        self.finales = []
+        for loc, land in traps.items():
+            before = self.reach(bubbleset, avoid=loc)
+            entries = [
+                dest for dest in (self.step(loc, dir, frozen=False) for dir in keys)
+                if dest in before
+            ]
+            self.finales.append((
+                self.bubble[self.cells[loc]],
+                self.fieldshift + self.field[self.cells[land]],
+                sum(land) % 2,
+                1 - sum(loc) % 2,
+                all(self.field[self.cells[dest]] is None for dest in entries),
+                self.paddable(before, traps),
+            ))
+
+    def index(self, loc):
+        if loc not in self.cells:
+            self.cells[loc] = len(self.locs)
+            self.locs.append(loc)
+            self.field.append(None)
+            self.bubble.append(0)
+            self.star.append(0)
+        return self.cells[loc]
+
+    def paddable(self, cells, traps):
+        """For each colour, whether cells has one without a field.
+
+        Those are where the fish can spend a move without advancing anything.
+        Other bubbles count, since they are open once ridden; traps do not.
+        """
+        padding = [False, False]
+        for loc in cells:
+            if loc not in traps and self.field[self.cells[loc]] is None:
+                padding[sum(loc) % 2] = True
+        return padding
+
+    def reach(self, bubbles, *, avoid=None):
+        """Cells the fish can get to from the start without entering avoid."""
+        seen = {self.start}
+        frontier = [self.start]
+        while frontier:
+            loc = frontier.pop()
+            dests = [self.step(loc, dir, frozen=False) for dir in keys]
+            if loc in bubbles:
+                dests.append(self.rise(loc))
+            for dest in dests:
+                if dest is not None and dest != avoid and dest not in seen:
+                    seen.add(dest)
+                    frontier.append(dest)
+        return seen
+
+    def rise(self, loc):
+        while True:
+            dest = self.step(loc, Dir.n, frozen=True)
+            if dest is None:
+                return loc
+            loc = dest
+
+    def step(self, loc, dir, *, frozen):
+        gx, gy = loc
+        dx, dy = dir
+        dest = gx + dx, gy + dy
+        if not (0 <= dest[0] < self.width and 0 <= dest[1] < self.height):
+            return None
+        if dest in self.walls or (dest in self.bwalls and not frozen):
+            return None
+        return dest
+
+    def fields(self, state):
+        return (state >> self.fieldshift) & self.fieldmask
+
+    def estimate(self, state, needed):
+        """A lower bound on the moves left, given needed() for state.
+
+        Every visit to a field advances it by one, so a field gets its needed
+        visits plus a multiple of three. Ordinary moves alternate between the
+        two colours of a checkerboard, which ties the number of visits to
+        each colour together; every bubble ride can break the alternation.
+        Returns None when no route can satisfy both.
+        """
+        pos = state & self.posmask
+        colour = self.colour[pos]
+        bubbles = state >> self.bubbleshift & self.bubblemask
+        rides = bin(bubbles).count('1')
+        stranded, forced = self.stranded(state, pos)
+        for bubble, shift, landcolour, entrycolour, bare, padding in self.finales:
+            if not bubble & bubbles or state >> shift & 3 != 1:
+                continue
+            # The route ends: ... entry cell, then the ride onto the field.
+            needed = list(needed)
+            needed[landcolour] -= 1
+            balance = 1 if entrycolour != colour else 0
+            if bare and (needed[0] or needed[1]):
+                forced = list(forced)
+                forced[entrycolour] = 1
+            slack = 2 * (rides - 1)
+            cost = self._alternate(
+                needed, colour, balance - slack, balance + slack,
+                stranded, forced, padding)
+            return None if cost is None else cost + 1
+        return self._alternate(
+            needed, colour, -rides, 1 + rides, stranded, forced, self.padding)
+
+    def stranded(self, state, pos):
+        """Revisits forced by fields that still need visits but are walled in.
+
+        To visit such a field (or to come back to it) the fish has to pass
+        through a neighbour that needs nothing more: three visits if that is
+        a finished field, one if it is an open cell. Returns the minimum
+        extra field visits and open-cell visits per colour.
+        """
+        extra = [0, 0]
+        forced = [0, 0]
+        for cell, shift, around, neighbours, kind in self.surroundings:
+            left = (2 - (state >> shift & 3)) % 3
+            if not left or (left == 1 and cell != pos and cell in self.adjacent[pos]):
+                continue
+            if kind == 'closed':
+                return None, None
+            if any(state >> n & 3 != 2 for n in neighbours):
+                continue
+            if kind == 'fields':
+                extra[around] = 3
+            elif kind == 'open':
+                forced[around] = 1
+        return extra, forced
+
+    def _alternate(self, needed, colour, low, high, stranded, forced, padding):
+        """Fewest visits covering needed, with low <= other - same <= high.
+
+        other and same count the visits to cells of the colour opposite to
+        and the same as colour; stranded gives extra field visits and forced
+        visits to open cells that have to be made on each colour.
+        """
+        if stranded is None:
+            return None
+        other, same = 1 - colour, colour
+        best = None
+        for extraother in (0, 3, 6):
+            if extraother < stranded[other]:
+                continue
+            for extrasame in (0, 3, 6):
+                if extrasame < stranded[same]:
+                    continue
+                visits = [needed[0], needed[1]]
+                visits[other] += extraother + forced[other]
+                visits[same] += extrasame + forced[same]
+                balance = visits[other] - visits[same]
+                if balance < low:
+                    if not padding[other]:
+                        continue
+                    visits[other] += low - balance
+                elif balance > high:
+                    if not padding[same]:
+                        continue
+                    visits[same] += balance - high
+                if best is None or sum(visits) < best:
+                    best = sum(visits)
+        return best
+
+    def needed(self, state):
+        """Field advances still needed, split by checkerboard colour."""
+        fields = self.fields(state)
+        needed = [0, 0]
+        for i, loc in enumerate(self.fieldlocs):
+            needed[sum(loc) % 2] += (2 - (fields >> 2 * i & 3)) % 3
+        return tuple(needed)
+
+    def successors(self, state):
+        """Yield (key, next state, cell, change) for every legal move.
+
+        change is how much needed() changed for the colour of cell.
+        """
+        pos = state & self.posmask
+        bubbles = state >> self.bubbleshift
+        for key, dest in self.moves[pos]:
+            if dest is None:
+                continue
+            new = state
+            bubble = self.bubble[dest] & bubbles
+            if bubble:
+                land = self.landing[dest]
+                if self.bubble[land] & bubbles & ~bubble:
+                    continue
+                new ^= bubble << self.bubbleshift
+                dest = land
+            new = new & ~self.posmask | dest
+            delta = 0
+            shift = self.field[dest]
+            if shift is not None:
+                shift += self.fieldshift
+                old = new >> shift & 3
+                new += ((old + 1) % 3 - old) << shift
+                delta = 2 if old == 2 else -1
+            new &= ~(self.star[dest] << self.starshift)
+            yield key, new, dest, delta
+
+    def done(self, state, *, stars=False):
+        if self.fields(state) != self.goal:
+            return False
+        return not stars or not state >> self.starshift
+
+    def walkable(self):
+        """Cells the fish can get to from the start without riding a bubble."""
+        start = self.cells[self.start]
+        seen = {start}
+        frontier = [start]
+        while frontier:
+            cell = frontier.pop()
+            for dest in self.adjacent[cell]:
+                if not self.bubble[dest] and dest not in seen:
+                    seen.add(dest)
+                    frontier.append(dest)
+        return seen
+
+    def key(self, cell, dest):
+        return next(key for key, move in self.moves[cell] if move == dest)
+
+    def follow(self, moves, state=None):
+        """The state after moves, or None if one of them goes nowhere."""
+        state = self.initial if state is None else state
+        for key in moves:
+            for move, new, _, _ in self.successors(state):
+                if move == key:
+                    state = new
+                    break
+            else:
+                return None
+        return state
+
+
+class _Flow:
+    """Cheapest flow meeting lower and upper bounds on every arc.
+
+    Costs must not be negative. Arcs are [dest, room left, cost, index of
+    the reverse arc]; add() returns the arc, so its flow is high - arc[1].
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.arcs = [[] for _ in range(size + 2)]
+        self.excess = [0] * size
+
+    def add(self, u, v, low, high, cost=0):
+        self.excess[u] -= low
+        self.excess[v] += low
+        return self._arc(u, v, high - low, cost)
+
+    def _arc(self, u, v, room, cost):
+        arc = [v, room, cost, len(self.arcs[v])]
+        self.arcs[u].append(arc)
+        self.arcs[v].append([u, 0, -cost, len(self.arcs[u]) - 1])
+        return arc
+
+    def run(self):
+        """Push flow until every bound is met; return whether that worked."""
+        source, sink = self.size, self.size + 1
+        wanted = 0
+        for node, excess in enumerate(self.excess):
+            if excess > 0:
+                self._arc(source, node, excess, 0)
+                wanted += excess
+            elif excess < 0:
+                self._arc(node, sink, -excess, 0)
+        # Successive shortest paths, with Dijkstra on reduced costs.
+        potential = [0] * len(self.arcs)
+        while wanted:
+            dist = [None] * len(self.arcs)
+            dist[source] = 0
+            via = [None] * len(self.arcs)
+            queue = [(0, source)]
+            while queue:
+                d, node = heapq.heappop(queue)
+                if d > dist[node]:
+                    continue
+                for arc in self.arcs[node]:
+                    dest, room, cost, _ = arc
+                    if room:
+                        nd = d + cost + potential[node] - potential[dest]
+                        if dist[dest] is None or nd < dist[dest]:
+                            dist[dest] = nd
+                            via[dest] = node, arc
+                            heapq.heappush(queue, (nd, dest))
+            if dist[sink] is None:
+                return False
+            # Capping at the sink's distance keeps every reduced cost in
+            # the residual graph from going negative.
+            far = dist[sink]
+            for node, d in enumerate(dist):
+                potential[node] += far if d is None else min(d, far)
+            push, node = wanted, sink
+            while node != source:
+                node, arc = via[node]
+                push = min(push, arc[1])
+            node = sink
+            while node != source:
+                node, arc = via[node]
+                arc[1] -= push
+                self.arcs[arc[0]][arc[3]][1] += push
+            wanted -= push
+        return True
+
+
+def _construct(level, *, stars=False, deadline=None):
+    """Build a winning route on foot from how often each cell is visited.
+
+    A field ends up purple if its visits are its needed ones plus a multiple
+    of three, whatever their order. So this picks the visits per cell (the
+    needed ones, or those plus three for one field), lets a minimum-cost
+    flow choose the fewest moves that make them, and turns those moves into
+    one walk. A trap bubble whose field needs its last visit can be ridden
+    at the end. Levels that need any other ride are left to the search.
+    Returns the moves, or None, and how many sets of visits it tried; the
+    route is short but only proven shortest if it matches Level.estimate.
+    """
+    cells = sorted(level.walkable())
+    walkable = set(cells)
+    start = level.cells[level.start]
+    fields = level.fields(level.initial)
+    needed = {
+        cell: (2 - (fields >> shift & 3)) % 3
+        for cell, shift in enumerate(level.field) if shift is not None
+    }
+    outside = [cell for cell, left in needed.items() if left and cell not in walkable]
+    starcells = [cell for cell in cells if level.star[cell]] if stars else []
+    if stars and any(level.star[cell] for cell in range(len(level.locs))
+                     if cell not in walkable):
+        return None, 0
+    ends, finale = cells, None
+    if outside:
+        if len(outside) > 1 or needed[outside[0]] != 1:
+            return None, 0
+        bubbles = [
+            cell for cell in range(len(level.locs))
+            if level.bubble[cell] and level.landing[cell] == outside[0]
+            and not level.adjacent[outside[0]]
+        ]
+        if not bubbles:
+            return None, 0
+        # More than one bubble landing there is rare enough to try only one.
+        ends = [cell for cell in level.adjacent[bubbles[0]] if cell in walkable]
+        finale = bubbles[0]
+    fieldcells = [cell for cell in cells if cell in needed]
+    bound = level.estimate(level.initial, level.needed(level.initial))
+    best = None
+    tried = 0
+    for bump in itertools.chain([None], fieldcells):
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        visits = {cell: needed[cell] for cell in fieldcells}
+        if bump is not None:
+            visits[bump] += 3
+        tried += 1
+        edges = _visit(level, cells, visits, ends, starcells)
+        if edges is None or (best is not None and len(edges) + (finale is not None) >= len(best)):
+            continue
+        edges = _untangle(level, walkable, edges, start)
+        if edges is None:
+            continue
+        path = _trail(edges, start)
+        moves = [level.key(u, v) for u, v in zip(path, path[1:])]
+        if finale is not None:
+            moves.append(level.key(path[-1], finale))
+        moves = ''.join(moves)
+        state = level.follow(moves)
+        if state is not None and level.done(state, stars=stars):
+            best = moves
+        if best is not None and len(best) <= bound:
+            break
+    return best, tried
+
+
+def _visit(level, cells, visits, ends, stars):
+    """The fewest moves that visit each field visits[cell] times.
+
+    Each cell is split into an arc from its way in to its way out, carrying
+    exactly its visits (stars at least one). A route from the start to one
+    of ends becomes a circulation by sending the fish back from the end to
+    the start's way out. Returns the moves as (cell, cell) pairs in no
+    particular order, or None.
+    """
+    index = {cell: i for i, cell in enumerate(cells)}
+    hub = 2 * len(cells)
+    flow = _Flow(hub + 1)
+    many = 4 * sum(visits.values()) + 4 * len(cells)
+    for cell, i in index.items():
+        if cell in visits:
+            flow.add(2 * i, 2 * i + 1, visits[cell], visits[cell])
+        else:
+            flow.add(2 * i, 2 * i + 1, 1 if cell in stars else 0, many)
+    moves = [
+        (cell, dest, flow.add(2 * i + 1, 2 * index[dest], 0, many, 1))
+        for cell, i in index.items()
+        for dest in level.adjacent[cell] if dest in index
+    ]
+    for cell in ends:
+        flow.add(2 * index[cell] + 1, hub, 0, 1)
+    flow.add(hub, 2 * index[level.cells[level.start]] + 1, 1, 1)
+    if not flow.run():
+        return None
+    return [(cell, dest) for cell, dest, arc in moves for _ in range(many - arc[1])]
+
+
+def _untangle(level, cells, edges, start, *, rounds=50):
+    """Rearrange edges into one connected piece, or return None.
+
+    The flow often splits into separate loops. Swapping two opposite sides
+    of a square of cells for the other two keeps every cell's visits, so
+    this swaps at random, keeping swaps that do not split anything further,
+    until the moves all hang together.
+    """
+    squares = []
+    for cell in cells:
+        x, y = level.locs[cell]
+        square = [level.cells.get(loc) for loc in ((x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1))]
+        if all(corner in cells for corner in square) and all(
+                square[i - 1] in level.adjacent[square[i]] for i in range(4)):
+            squares.append(square)
+    count = Counter(_side(u, v) for u, v in edges)
+    pieces = _pieces(count, start)
+    rng = random.Random(0)
+    for _ in range(rounds * len(edges)):
+        if pieces == 1:
+            return list(count.elements())
+        if not squares:
+            return None
+        a, b, c, d = rng.choice(squares)
+        if rng.random() < 0.5:
+            a, b, c, d = b, c, d, a
+        old, new = [_side(a, b), _side(c, d)], [_side(b, c), _side(d, a)]
+        count.subtract(old)
+        if min(count[old[0]], count[old[1]]) < 0:
+            count.update(old)
+            continue
+        count.update(new)
+        split = _pieces(count, start)
+        # Now and then accept a worse arrangement to get out of dead ends.
+        if split <= pieces or rng.random() < 0.05:
+            pieces = split
+        else:
+            count.subtract(new)
+            count.update(old)
+    return None
+
+
+def _side(u, v):
+    return (u, v) if u < v else (v, u)
+
+
+def _pieces(count, start):
+    """How many connected pieces the edges in count and start make up."""
+    parent = {start: start}
+
+    def find(cell):
+        while parent.setdefault(cell, cell) != cell:
+            parent[cell] = parent[parent[cell]]
+            cell = parent[cell]
+        return cell
+
+    for (u, v), n in count.items():
+        if n:
+            parent[find(u)] = find(v)
+    return len({find(cell) for cell in parent})
+
+
+def _trail(edges, start):
+    """Cells along a walk from start that uses every edge once (Hierholzer)."""
+    graph = defaultdict(list)
+    for i, (u, v) in enumerate(edges):
+        graph[u].append((v, i))
+        graph[v].append((u, i))
+    used = [False] * len(edges)
+    stack, path = [start], []
+    while stack:
+        cell = stack[-1]
+        while graph[cell] and used[graph[cell][-1][1]]:
+            graph[cell].pop()
+        if graph[cell]:
+            dest, i = graph[cell].pop()
+            used[i] = True
+            stack.append(dest)
+        else:
+            path.append(stack.pop())
+    return path[::-1]
+
+
+def solve(map, *, stars=False, limit=None, seconds=None, **kwargs):
+    """Return the shortest Solution for map, or None if there is none.
+
+    With stars, every star has to be collected too. limit caps the number of
+    states expanded and seconds the time taken; hitting either raises GaveUp.
+    """
+    deadline = None if seconds is None else time.perf_counter() + seconds
+    level = Level(map, **kwargs)
+    start = level.initial
+    # A* on moves with Level.estimate as the heuristic. Ties go to the deeper
+    # state, which finds routes without wasted moves quickly.
+    parents = {start: None}
+    cost = {start: 0}
+    counter = itertools.count()
+    needed = level.needed(start)
+    estimate = level.estimate(start, needed)
+    if estimate is None:
+        return None
+    # A route built from visit counts is often as short as the estimate on
+    # big open levels, where the search would take far too long to agree.
+    route, tried = _construct(level, stars=stars, deadline=deadline)
+    if route is not None and len(route) == estimate:
+        return Solution(route, tried)
+    queue = [(estimate, 0, next(counter), start, needed)]
+    explored = 0
+    while queue:
+        _, negdepth, _, state, needed = heapq.heappop(queue)
+        depth = -negdepth
+        if depth > cost[state]:
+            continue
+        if level.done(state, stars=stars):
+            return Solution(_path(parents, state), explored)
+        if limit is not None and explored >= limit:
+            raise GaveUp('gave up after {} states'.format(limit), explored, route)
+        if deadline is not None and not explored % 1000 and time.perf_counter() > deadline:
+            raise GaveUp('gave up after {:g}s'.format(seconds), explored, route)
+        explored += 1
+        for key, new, dest, delta in level.successors(state):
+            if new in cost and cost[new] <= depth + 1:
+                continue
+            cost[new] = depth + 1
+            parents[new] = state, key
+            newneeded = needed
+            if delta:
+                newneeded = list(needed)
+                newneeded[level.colour[dest]] += delta
+                newneeded = tuple(newneeded)
+            estimate = level.estimate(new, newneeded)
+            if estimate is None:
+                continue
+            f = depth + 1 + estimate
+            heapq.heappush(queue, (f, -depth - 1, next(counter), new, newneeded))
+    return None
+
+
+def _path(parents, state):
+    moves = []
+    while parents[state] is not None:
+        state, key = parents[state]
+        moves.append(key)
+    return ''.join(reversed(moves))
+
+
+def check(map, moves, *, timeout=1000):
+    """Play moves in the headless simulation and report whether it wins.
+
+    Each key is pressed once the fish has finished its previous move (or
+    ride), the way a careful player would.
+    """
+    from .sim import World
+    world = World(maps=[map])
+    world.mapindex = 0
+    world.reset()
+    player = world.player
+    for key in itertools.chain(moves, [None]):
+        for _ in range(timeout):
+            world.step()
+            if world.mode != 'go' or not (player.frozen or player.actions):
+                # A fish dropped off by a bubble touches what it landed on
+                # during the following tick.
+                world.step()
+                break
+        if key is not None:
+            world.press(key)
+    return world.mode == 'stop'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m game.solve')
+    parser.add_argument('levels', nargs='*', type=int)
+    parser.add_argument('--stars', action='store_true', help='collect every star too')
+    parser.add_argument('--check', action='store_true', help='replay solutions in the simulation')
+    parser.add_argument('--limit', type=int, default=2000000, help='states to expand per level')
+    parser.add_argument('--seconds', type=float, default=60, help='time to spend per level')
+    args = parser.parse_args(argv)
+    for index in args.levels or range(len(maps.maps)):
+        map = maps.maps[index]
+        start = time.perf_counter()
+        try:
+            solution = solve(map, stars=args.stars, limit=args.limit, seconds=args.seconds)
+        except GaveUp as e:
+            print('level {}: {} ({:.2f}s)'.format(index, e, time.perf_counter() - start))
+            if e.moves is not None:
+                print('  {} moves, maybe not the fewest: {}'.format(len(e.moves), e.moves))
+                if args.check:
+                    print('  check: ' + ('ok' if check(map, e.moves) else 'FAILED'))
+            continue
+        elapsed = time.perf_counter() - start
+        if solution is None:
+            print('level {}: unsolvable ({:.2f}s)'.format(index, elapsed))
+            continue
+        print('level {}: {} moves, {} explored, {:.2f}s'.format(
+            index, len(solution.moves), solution.explored, elapsed))
+        print('  ' + solution.moves)
+        if args.check:
+            print('  check: ' + ('ok' if check(map, solution.moves) else 'FAILED'))
+
+
+if __name__ == '__main__':
+    main()
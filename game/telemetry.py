@@ -0,0 +1,105 @@
+"""Frame-phase timings: rolling percentiles and a trace that can be saved.
+
+World.step() times its phases through world.timings, which is a NullTimings
+that does nothing unless profiling was asked for; the game adds its drawing
+and resets when run with --profile.
+"""
+from collections import defaultdict, deque
+import csv
+import json
+import time
+
+
+class Timings:
+    """Timings per named phase, in seconds.
+
+    Each phase keeps its last `window` samples for percentiles, and every
+    sample also goes into the trace, tagged with the current frame, unless
+    the trace already holds `tracelimit` samples.
+    """
+    def __init__(self, *, window=300, tracelimit=1000000):
+        self.recent = defaultdict(lambda: deque(maxlen=window))
+        self.trace = []
+        self.tracelimit = tracelimit
+        self.frame = 0
+
+    def add(self, name, seconds):
+        self.recent[name].append(seconds)
+        if len(self.trace) < self.tracelimit:
+            self.trace.append((self.frame, name, seconds))
+
+    def phase(self, name):
+        """A context manager that times its body as one sample of name."""
+        return _Phase(self, name)
+
+    def percentiles(self, name, ps=(50, 95, 99)):
+        samples = sorted(self.recent[name])
+        if not samples:
+            return tuple(0.0 for _ in ps)
+        return tuple(samples[min(len(samples) - 1, len(samples) * p // 100)] for p in ps)
+
+    def summary(self):
+        """{phase: {'p50', 'p95', 'p99' in ms, 'count'}} over the recent window."""
+        summary = {}
+        for name in sorted(self.recent):
+            p50, p95, p99 = self.percentiles(name)
+            summary[name] = {
+                'p50': round(p50 * 1e3, 3),
+                'p95': round(p95 * 1e3, 3),
+                'p99': round(p99 * 1e3, 3),
+                'count': len(self.recent[name]),
+            }
+        return summary
+
+    def dump(self, path):
+        """Write the trace as CSV if path ends in .csv, otherwise as JSON."""
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(['frame', 'phase', 'ms'])
+                for frame, name, seconds in self.trace:
+                    writer.writerow([frame, name, round(seconds * 1e3, 4)])
+            else:
+                json.dump({
+                    'summary': self.summary(),
+                    'trace': [
+                        [frame, name, round(seconds * 1e3, 4)]
+                        for frame, name, seconds in self.trace
+                    ],
+                }, f)
+
+
+class NullTimings:
+    """Stands in for Timings when nothing is being measured."""
+    frame = 0
+
+    def add(self, name, seconds):
+        pass
+
+    def phase(self, name):
+        return _null
+
+
+class _Phase:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+
+
+class _NullPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null = _NullPhase()
@@ -0,0 +1,111 @@
+"""Solve every level in parallel and write a JSON report.
+
+    python -m game.validate [FILE ...] [-o REPORT] [--jobs N] [--check] [--seconds N]
+
+Each FILE holds one map in the same format as the strings in maps.maps; the
+built-in levels are always included. The report lists, per level, whether it
+is solvable, the number of moves and whether that is proven optimal, the
+states explored (for a route built from visit counts, the visit counts tried)
+and the wall time, and is written with sorted keys so reports from two
+commits diff cleanly. A level the solver gives up on is solvable but not
+optimal if it still found a route, and unknown if not. The exit status is 1
+if any level is unsolvable.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sys
+import time
+
+from . import maps
+from .solve import GaveUp, check, solve
+
+
+def validate(name, map, *, limit=None, seconds=None, replay=False):
+    """Solve one level and return its entry for the report."""
+    start = time.perf_counter()
+    entry = {'level': name}
+    try:
+        solution = solve(map, limit=limit, seconds=seconds)
+    except GaveUp as e:
+        if e.moves is None:
+            entry.update(status='unknown', explored=e.explored)
+        else:
+            entry.update(
+                status='solvable',
+                moves=len(e.moves),
+                optimal=False,
+                solution=e.moves,
+                explored=e.explored,
+            )
+            if replay:
+                entry['check'] = check(map, e.moves)
+        solution = None
+    except ValueError as e:
+        entry.update(status='invalid', error=str(e))
+        solution = None
+    else:
+        if solution is None:
+            entry.update(status='unsolvable')
+        else:
+            entry.update(
+                status='solvable',
+                moves=len(solution.moves),
+                optimal=True,
+                solution=solution.moves,
+                explored=solution.explored,
+            )
+            if replay:
+                entry['check'] = check(map, solution.moves)
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def levels(paths):
+    """(name, map) for the built-in levels, then one for each file."""
+    for index, map in enumerate(maps.maps):
+        yield 'maps.maps[{}]'.format(index), map
+    for path in paths:
+        with open(path) as f:
+            yield path, f.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m game.validate')
+    parser.add_argument('files', nargs='*', help='extra map files')
+    parser.add_argument('-o', '--output', help='write the report here instead of stdout')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--limit', type=int, default=2000000, help='states to expand per level')
+    parser.add_argument('--seconds', type=float, default=60, help='time to spend per level')
+    parser.add_argument('--check', action='store_true', help='replay solutions in the simulation')
+    args = parser.parse_args(argv)
+
+    names, mapstrings = zip(*levels(args.files))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.jobs) as pool:
+        futures = [
+            pool.submit(
+                validate, name, map,
+                limit=args.limit, seconds=args.seconds, replay=args.check)
+            for name, map in zip(names, mapstrings)
+        ]
+        entries = [future.result() for future in futures]
+    report = {
+        'levels': entries,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    for entry in entries:
+        print('{level}: {status}'.format(**entry), file=sys.stderr)
+    if any(entry['status'] in ('unsolvable', 'invalid') for entry in entries):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ setup(
     install_requires=[
         'pyglet',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     name='game',
     packages=find_packages(),
     version='0.1',